@@ -0,0 +1,101 @@
+"""Measure EntryFilter throughput over synthetic glideresource ads
+
+Usage: python benchmarks/bench_filter.py [--sizes 10000,100000] [--classads]
+"""
+
+import argparse
+import fnmatch
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from ospool.utils.query import EntryFilter
+from synthetic import generate_ads
+
+
+class LegacyEntryFilter(object):
+    """The original per-ad filter, kept as a reference point."""
+
+    def __init__(self, resource=None, gpus_only=False, ce_hostname=None, entry=None, factory=None):
+        self.resource = resource.lower() if resource else None
+        self.gpus_only = gpus_only
+        self.ce_hostname = ce_hostname.lower() if ce_hostname else None
+        self.entry = entry.lower() if entry else None
+        self.factory = factory.lower() if factory else None
+
+    def __call__(self, entry):
+        if self.gpus_only:
+            if 'GLIDEIN_Resource_Slots' not in entry:
+                return False
+            has_gpu = False
+            for resource_command in entry['GLIDEIN_Resource_Slots'].split(";"):
+                if resource_command.split(",")[0] == 'GPUs':
+                    has_gpu = True
+                    break
+            if not has_gpu:
+                return False
+        factory = entry['GlideFactoryName'].rsplit("@", 1)[-1].lower()
+        if self.factory is not None and factory != self.factory:
+            return False
+        entry_name = entry['GlideFactoryName'].split("@", 1)[0].lower()
+        if self.entry is not None and not fnmatch.fnmatch(entry_name, self.entry):
+            return False
+        if self.resource is not None:
+            if 'GLIDEIN_ResourceName' not in entry or not fnmatch.fnmatch(entry['GLIDEIN_ResourceName'].lower(), self.resource):
+                return False
+        if self.ce_hostname is not None:
+            if 'GLIDEIN_Gatekeeper' not in entry:
+                return False
+            ce_hostname = entry['GLIDEIN_Gatekeeper'].split(' ', 1)[0].lower()
+            if not fnmatch.fnmatch(ce_hostname, self.ce_hostname):
+                return False
+        return True
+
+
+scenarios = [
+    ("factory only", dict(factory="OSG")),
+    ("entry glob", dict(factory="OSG", entry="OSG_US_CHTC_*")),
+    ("resource glob", dict(factory="OSG", resource="*chtc*")),
+    ("all filters", dict(factory="OSG", entry="OSG_US_*", resource="*-CE1*", ce_hostname="*.edu", gpus_only=True)),
+]
+
+
+def _throughput(func, ads, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(ads)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(ads) / best, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000", help="Comma-separated list of ad counts.")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions per measurement; the best is reported.")
+    parser.add_argument("--classads", action="store_true", help="Benchmark against classad.ClassAd objects instead of dictionaries.")
+    args = parser.parse_args()
+
+    print("{:>8}  {:<14} {:>14} {:>14} {:>14} {:>8}".format(
+        "ads", "scenario", "legacy ads/s", "call ads/s", "batch ads/s", "matched"))
+    for size in (int(value) for value in args.sizes.split(",")):
+        ads = generate_ads(size)
+        if args.classads:
+            import classad
+            ads = [classad.ClassAd(ad) for ad in ads]
+        for name, kwargs in scenarios:
+            legacy = LegacyEntryFilter(**kwargs)
+            compiled = EntryFilter(**kwargs)
+            legacy_rate, matched = _throughput(lambda ads: [ad for ad in ads if legacy(ad)], ads, args.repeat)
+            call_rate, _ = _throughput(lambda ads: [ad for ad in ads if compiled(ad)], ads, args.repeat)
+            batch_rate, batch_matched = _throughput(compiled.filter_many, ads, args.repeat)
+            assert matched == batch_matched
+            print("{:>8}  {:<14} {:>14,.0f} {:>14,.0f} {:>14,.0f} {:>8}".format(
+                size, name, legacy_rate, call_rate, batch_rate, matched))
+
+
+if __name__ == "__main__":
+    main()
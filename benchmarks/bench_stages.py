@@ -0,0 +1,143 @@
+"""Measure time and peak memory of each stage of `ospool show` against offline fixtures
+
+Usage: python benchmarks/bench_stages.py [--sizes 1000,10000,100000]
+                                         [--save-baseline PATH] [--baseline PATH] [--threshold 0.25]
+
+The stages are: query (the file-backed collector applying the constraint and
+projection), filter (EntryFilter.filter_many), group (building model.Entry objects), and
+render (the human-readable output, built as one string).  Peak memory covers Python
+allocations only, as reported by tracemalloc.
+
+With --baseline, the script exits non-zero if any stage is slower, or uses more memory,
+than the baseline by more than --threshold (as a fraction).
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import ospool.model as model
+import ospool.utils.backend as backend
+import ospool.utils.query as query
+import ospool.utils.render as render
+from fixtures import default_sizes, ensure_fixture
+
+
+default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Differences below these are treated as noise rather than regressions.
+MIN_SECONDS_DELTA = 0.005
+MIN_BYTES_DELTA = 64 * 1024
+
+
+def run_stages(path):
+    """
+    Yield (stage name, callable) pairs; each callable consumes the previous stage's result.
+    """
+    filter_obj = query.EntryFilter(factory="OSG")
+    projection = sorted(set(render.entry_attrs).union(filter_obj.get_projection_attrs()))
+    collector = backend.FileCollector(path)
+
+    def query_stage(_):
+        return collector.query('any', filter_obj.get_constraint(), projection)
+
+    def filter_stage(ads):
+        return filter_obj.filter_many(ads)
+
+    def group_stage(ads):
+        return model.entries_from_ads(ads)
+
+    def render_stage(entries):
+        return "".join(render.format_entry(entry) for entry in entries)
+
+    return [("query", query_stage), ("filter", filter_stage), ("group", group_stage), ("render", render_stage)]
+
+
+def measure(path, repeat):
+    # Load the fixture up front; a real collector already holds its ads in memory.
+    backend.FileCollector(path).query('any', 'false', [])
+
+    results = {}
+    stages = run_stages(path)
+
+    value = None
+    for name, func in stages:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func(value)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = {"seconds": best}
+        value = result
+
+    value = None
+    for name, func in stages:
+        tracemalloc.start()
+        value = func(value)
+        results[name]["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name]["count"] = len(value)
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Return a list of human-readable regressions of `results` relative to `baseline`.
+    """
+    regressions = []
+    for size, stages in results.items():
+        for stage, current in stages.items():
+            previous = baseline.get(size, {}).get(stage)
+            if not previous:
+                continue
+            for metric, noise in (("seconds", MIN_SECONDS_DELTA), ("peak_bytes", MIN_BYTES_DELTA)):
+                limit = previous[metric] * (1 + threshold)
+                if current[metric] > limit and current[metric] - previous[metric] > noise:
+                    regressions.append("{} ads, {} stage: {} is {:.4g}, baseline {:.4g} (+{:.0%})".format(
+                        size, stage, metric, current[metric], previous[metric], current[metric] / previous[metric] - 1))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=",".join(str(size) for size in default_sizes), help="Comma-separated list of ad counts.")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions per timing; the best is reported.")
+    parser.add_argument("--baseline", help="Compare against the results saved in this file (default: {} if it exists).".format(default_baseline))
+    parser.add_argument("--save-baseline", metavar="PATH", help="Save the results to this file.")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed fractional regression relative to the baseline.")
+    args = parser.parse_args()
+
+    results = {}
+    print("{:>8}  {:<8} {:>10} {:>12} {:>8}".format("ads", "stage", "seconds", "peak MiB", "count"))
+    for size in (int(value) for value in args.sizes.split(",")):
+        stages = measure(ensure_fixture(size), args.repeat)
+        results[str(size)] = stages
+        for stage, result in stages.items():
+            print("{:>8}  {:<8} {:>10.4f} {:>12.2f} {:>8}".format(
+                size, stage, result["seconds"], result["peak_bytes"] / 2**20, result["count"]))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+    baseline_path = args.baseline or (default_baseline if os.path.exists(default_baseline) and not args.save_baseline else None)
+    if baseline_path:
+        with open(baseline_path) as fp:
+            regressions = compare(results, json.load(fp), args.threshold)
+        if regressions:
+            print("\nRegressions relative to {}:".format(baseline_path))
+            for regression in regressions:
+                print("  " + regression)
+            sys.exit(1)
+        print("\nNo regressions relative to {}".format(baseline_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Create glideresource ad fixtures for the file-backed collector
+
+Usage:
+    python benchmarks/fixtures.py generate [--sizes 1000,10000,100000]
+    python benchmarks/fixtures.py record [--pool flock.opensciencegrid.org] OUTPUT
+
+Generated fixtures are written to benchmarks/fixtures/synthetic-<size>.jsonl; any of
+them (or a recorded file) can be used offline with `ospool show --pool file:<path>`.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from synthetic import generate_ads
+
+
+fixture_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+default_sizes = [1000, 10000, 100000]
+
+
+def fixture_path(size):
+    return os.path.join(fixture_dir, "synthetic-{}.jsonl".format(size))
+
+
+def ensure_fixture(size):
+    """
+    Return the path of the synthetic fixture with `size` ads, generating it if needed.
+    """
+    path = fixture_path(size)
+    if not os.path.exists(path):
+        os.makedirs(fixture_dir, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as fp:
+            for ad in generate_ads(size):
+                fp.write(json.dumps(ad) + "\n")
+        os.replace(tmp_path, path)
+    return path
+
+
+def record(pool, output):
+    """
+    Save every glideresource ad from a live collector in `condor_status -long` format.
+    """
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+    import ospool.utils.backend as backend
+    import ospool.utils.query as query
+
+    ads = backend.HTCondorCollector(pool).query('any', query.glideresource_constraint, [])
+    with open(output, "w") as fp:
+        for ad in ads:
+            fp.write(ad.printOld() + "\n")
+    return len(ads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command")
+    generate_parser = subparsers.add_parser("generate", help="Generate synthetic fixtures.")
+    generate_parser.add_argument("--sizes", default=",".join(str(size) for size in default_sizes),
+        help="Comma-separated list of ad counts.")
+    record_parser = subparsers.add_parser("record", help="Record the ads of a live pool.")
+    record_parser.add_argument("--pool", default="flock.opensciencegrid.org", help="Collector to record.")
+    record_parser.add_argument("output", help="File to write the ads to.")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        for size in (int(value) for value in args.sizes.split(",")):
+            print(ensure_fixture(size))
+    elif args.command == "record":
+        print("Recorded {} ads to {}".format(record(args.pool, args.output), args.output))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
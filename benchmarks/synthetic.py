@@ -0,0 +1,60 @@
+"""Generate synthetic glideresource ads resembling those in the OSPool collector"""
+
+import random
+
+
+# Counters reported by the frontend and factory for each (entry, group) pair.
+counter_attrs = [
+    'GlideClientMonitorGlideinsRunning',
+    'GlideClientMonitorJobsIdle',
+    'GlideClientMonitorJobsRunningHere',
+    'GlideClientMonitorGlideinsIdle',
+    'GlideClientMonitorGlideinsRequestIdle',
+    'GlideClientMonitorGlideinsRequestMaxRun',
+    'GlideFactoryMonitorRequestedIdle',
+    'GlideFactoryMonitorRequestedMaxGlideins',
+    'GlideFactoryMonitorStatusIdle',
+    'GlideFactoryMonitorStatusRunning',
+    'GlideFactoryMonitorStatusPending',
+    'GlideFactoryMonitorStatusHeld',
+]
+
+groups = ['main', 'main-short', 'gpu', 'itb', 'dune', 'icecube', 'ligo', 'cms']
+
+sites = ['CHTC', 'UCSD', 'Syracuse', 'Nebraska', 'Purdue', 'UChicago', 'FNAL', 'SDSC', 'TACC', 'Clemson']
+
+
+def generate_ads(count, seed=0):
+    """
+    Return a list of `count` synthetic glideresource ads as dictionaries.
+    """
+    rnd = random.Random(seed)
+    ads = []
+    entry_count = max(count // len(groups), 1)
+    for idx in range(count):
+        entry_idx = idx % entry_count
+        site = sites[entry_idx % len(sites)]
+        gpu = entry_idx % 5 == 0
+        factory = 'OSG-ITB' if entry_idx % 9 == 0 else 'OSG'
+        entry_name = "OSG_US_{}_{}{}".format(site, entry_idx, "_gpu" if gpu else "")
+        ce_hostname = "ce{}.{}.edu".format(entry_idx % 97, site.lower())
+        ad = {
+            'MyType': 'glideresource',
+            'GlideFactoryName': "{}@gfactory_instance@{}".format(entry_name, factory),
+            'GlideGroupName': groups[(idx // entry_count) % len(groups)],
+            'GLIDEIN_ResourceName': "{}-CE{}".format(site.upper(), entry_idx % 13),
+            'GLIDEIN_Gatekeeper': "{0} {0}:9619".format(ce_hostname),
+            'GLIDEIN_CPUS': 'auto' if entry_idx % 7 == 0 else str(1 << (entry_idx % 4)),
+            'GLIDEIN_MaxMemMBs': 2048 * (1 + entry_idx % 8),
+            'GLIDEIN_In_Downtime': 'True' if entry_idx % 50 == 0 else 'False',
+        }
+        if entry_idx % 7 == 0:
+            ad['GLIDEIN_ESTIMATED_CPUS'] = 32
+        if gpu:
+            ad['GLIDEIN_Resource_Slots'] = 'GPUs,{},type=main'.format(1 + entry_idx % 4)
+        for attr in counter_attrs:
+            ad[attr] = rnd.randint(0, 500) if rnd.random() < 0.6 else 0
+        if entry_idx % 23 == 0:
+            ad['GlideClientLimitTotalGlideinsPerEntry'] = 'count=1000, limit=1000'
+        ads.append(ad)
+    return ads
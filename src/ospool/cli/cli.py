@@ -1,23 +1,70 @@
 
-import collections
+import cProfile
 import fnmatch
+import os
+import signal
+import sys
+import time
 
 import click
-import classad
-import htcondor
 
 from ospool import __version__
+import ospool.model as model
+import ospool.utils.backend as backend
 import ospool.utils.config as config
+import ospool.utils.history as history
+import ospool.utils.metrics as metrics
+import ospool.utils.output as output_utils
+import ospool.utils.projection as projection
 import ospool.utils.query as query
+import ospool.utils.render as render
+import ospool.utils.server as server
+import ospool.utils.slots as slots
+import ospool.utils.summary as summary
+import ospool.utils.timing as timing
+import ospool.utils.watch as watch
 
 
 @click.group(context_settings=dict(help_option_names=['-h', '--help']))
 @click.version_option(version=__version__)
-def ospool():
+@click.option("--timings", default=False, help="Print the time spent in each stage to stderr.", is_flag=True)
+@click.option("--metrics-file", help="Write stage timings and entry counters to this OpenMetrics textfile.", type=click.Path(dir_okay=False))
+@click.pass_context
+def ospool(ctx, timings, metrics_file):
     """
     Tools for querying the OSPool about pilot and payload jobs
+
+    Set $OSPOOL_PROFILE to a filename to save a cProfile dump of the command.
     """
 
+    if metrics_file and ctx.invoked_subcommand == "watch":
+        # The textfile is only written on exit, and would describe every iteration at once.
+        raise click.UsageError("--metrics-file cannot be used with watch; run a separate command for the metrics.")
+
+    timing.timings.enabled = timings or bool(metrics_file)
+    timing.timings.collect_entries = bool(metrics_file)
+
+    profile_path = os.environ.get("OSPOOL_PROFILE")
+    if profile_path:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        def dump_profile():
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+        ctx.call_on_close(dump_profile)
+
+    def report_timings():
+        # The pool history is written after the command's output, but before the report
+        # so the write is measured.
+        start = time.perf_counter()
+        if config.flush_pool_history():
+            timing.timings.add("pool history", time.perf_counter() - start)
+        if metrics_file:
+            metrics.write_metrics_file(metrics_file, timing.timings, command=ctx.invoked_subcommand)
+        if timings:
+            click.echo(timing.format_report(timing.timings), err=True)
+    ctx.call_on_close(report_timings)
+
 
 def filter_obj_from_ctx(ctx):
 
@@ -26,16 +73,35 @@ def filter_obj_from_ctx(ctx):
             factory=ctx.params.get('factory'), ce_hostname=ctx.params.get('ce_hostname'))
 
 
+def pools_from_params(pool, all_known_pools=False):
+
+    pools = [pool] if isinstance(pool, str) else list(pool)
+    if all_known_pools:
+        pools.extend(config.get_pools_by_usage())
+    return list(dict.fromkeys(pools))
+
+
+def query_entries_from_ctx(ctx):
+
+    pools = pools_from_params(ctx.params['pool'], ctx.params.get('all_known_pools'))
+    # Completing a word is not a use of the pool, and must not wait on the state store.
+    return query.query_pools(pools, filter_obj_from_ctx(ctx), projection.completion_projection, timeout=ctx.params.get('timeout'),
+        record_usage=False)
+
+
+def report_pool_error(pool, exc):
+
+    click.echo(click.style("WARNING:", fg='red', bold=True) + f" Failed to query pool {pool}: {exc}", err=True)
+
+
 class EntryType(click.ParamType):
 
     def shell_complete(self, ctx, param, incomplete):
 
-        filter_obj = filter_obj_from_ctx(ctx)
-
         entry_names = set()
-        for entry in query.query_entries(ctx.params['pool'], filter_obj, []):
-            if 'GlideFactoryName' in entry:
-                entry_names.add(entry['GlideFactoryName'].split("@")[0])
+        for entry in model.entries_from_ads(query_entries_from_ctx(ctx)):
+            if entry.name:
+                entry_names.add(entry.name)
 
         entry_names = list(entry_names)
         entry_names.sort()
@@ -46,12 +112,10 @@ class ResourceType(click.ParamType):
 
     def shell_complete(self, ctx, param, incomplete):
 
-        filter_obj = filter_obj_from_ctx(ctx)
-
         resource_names = set()
-        for entry in query.query_entries(ctx.params['pool'], filter_obj, []):
-            if 'GLIDEIN_ResourceName' in entry:
-                resource_names.add(entry['GLIDEIN_ResourceName'])
+        for entry in model.entries_from_ads(query_entries_from_ctx(ctx)):
+            if entry.resource is not None:
+                resource_names.add(entry.resource)
 
         resource_names = list(resource_names)
         resource_names.sort()
@@ -62,174 +126,453 @@ class CEHostnameType(click.ParamType):
 
     def shell_complete(self, ctx, param, incomplete):
 
-        filter_obj = filter_obj_from_ctx(ctx)
-
         ce_hostnames = set()
-        for entry in query.query_entries(ctx.params['pool'], filter_obj, []):
-            if 'GLIDEIN_Gatekeeper' in entry:
-                ce_hostnames.add(entry['GLIDEIN_Gatekeeper'].split(" ", 1)[0])
+        for entry in model.entries_from_ads(query_entries_from_ctx(ctx)):
+            if entry.ce_host is not None:
+                ce_hostnames.add(entry.ce_host)
 
         ce_hostnames = list(ce_hostnames)
         ce_hostnames.sort()
         return [click.shell_completion.CompletionItem(name) for name in ce_hostnames if name.startswith(incomplete)]
 
 
+class DurationType(click.ParamType):
+
+    name = "duration"
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, int):
+            return value
+        try:
+            return history.parse_duration(value)
+        except ValueError as exc:
+            self.fail(str(exc), param, ctx)
+
+
 class PoolType(click.ParamType):
 
     def shell_complete(self, ctx, param, incomplete):
-        return [click.shell_completion.CompletionItem(name) for name in config.get_pool_history() if name.startswith(incomplete)]
-
-
-def print_human_friendly_entry(entry, entries):
-
-    site_info = []
-    if 'GLIDEIN_ResourceName' in entries[0]:
-        site_info.append(f"Resource name {entries[0]['GLIDEIN_ResourceName']}")
-    if 'GLIDEIN_Gatekeeper' in entries[0]:
-        site_info.append(f"CE hostname {entries[0]['GLIDEIN_Gatekeeper'].split()[0]}")
-    site_info = " (" + ", ".join(site_info) + ")" if site_info else ""
-    click.echo("\nData for entry " + click.style(f"{entry}", bold=True) + site_info)
-    if 'GlideClientLimitTotalGlideinsPerEntry' in entries[0]:
-        click.echo(click.style("WARNING:", fg='red', bold=True) +
-            f" Requests will be reduced due to per-entry limit on total glideins: {entries[0]['GlideClientLimitTotalGlideinsPerEntry']}")
-    if 'GlideClientLimitIdleGlideinsPerEntry' in entries[0]:
-        click.echo(click.style("WARNING:", fg='red', bold=True) +
-            f" Requests will be reduced due to per-entry limit on idle glideins: {entries[0]['GlideClientLimitIdleGlideinsPerEntry']}")
-    if 'GlideClientLimitTotalGlideinsPerFrontend' in entries[0]:
-        click.echo(click.style("WARNING:", fg='red', bold=True) +
-            f" Requests will be reduced due to frontend limit on total glideins: {entries[0]['GlideClientLimitTotalGlideinsPerFrontend']}")
-    if 'GlideClientLimitIdleGlideinsPerFrontend' in entries[0]:
-        click.echo(click.style("WARNING:", fg='red', bold=True) +
-            f" Requests will be reduced due to frontend limit on idle glideins: {entries[0]['GlideClientLimitIdleGlideinsPerFrontend']}")
-    if 'GlideClientLimitTotalGlideinsGlobal' in entries[0]:
-        click.echo(click.style("WARNING:", fg='red', bold=True) +
-            f" Requests will be reduced due to pool-wide limit on total glideins: {entries[0]['GlideClientLimitTotalGlideinsGlobal']}")
-    if 'GlideClientLimitIdleGlideinsGlobal' in entries[0]:
-        click.echo(click.style("WARNING:", fg='red', bold=True) +
-            f" Requests will be reduced due to pool-wide limit on idle glideins: {entries[0]['GlideClientLimitIdleGlideinsGlobal']}")
-    if 'GlideFactoryMonitorStatus_GlideFactoryLimitTotalGlideinsPerEntry' in entries[0]:
-        click.echo(click.style("WARNING:", fg='red', bold=True) +
-                f" Requests will be reduced due to factory limit on total entry glideins: {entries[0]['GlideFactoryMonitorStatus_GlideFactoryLimitTotalGlideinsPerEntry']}")
-    if 'GlideFactoryMonitorStatus_GlideFactoryLimitIdleGlideinsPerEntry' in entries[0]:
-        click.echo(click.style("WARNING:", fg='red', bold=True) +
-                f" Requests will be reduced due to factory limit on entry idle glideins: {entries[0]['GlideFactoryMonitorStatus_GlideFactoryLimitIdleGlideinsPerEntry']}")
-    if 'GlideFactoryMonitorStatus_GlideFactoryLimitHeldGlideinsPerEntry' in entries[0]:
-            click.echo(click.style("WARNING:", fg='red', bold=True) +
-                f" Requests will be reduced due to factory limit on entry held glideins: {entries[0]['GlideFactoryMonitorStatus_GlideFactoryLimitHeldGlideinsPerEntry']}")
-
-    if 'GLIDEIN_CPUS' in entries[0]:
-        if entries[0]['GLIDEIN_CPUS'] == "auto":
-            print("- Whole node entry " + ("with an estimated {} cores per glidein".format(entries[0]['GLIDEIN_ESTIMATED_CPUS']) if 'GLIDEIN_ESTIMATED_CPUS' in entries[0] else ''))
-        elif entries[0]['GLIDEIN_CPUS'] == "1":
-            print(f"- Entry has 1 core per glidein")
-        else:
-            print(f"- Entry has {entries[0]['GLIDEIN_CPUS']} cores per glidein")
+        return [click.shell_completion.CompletionItem(name) for name in config.get_pools_by_usage() if name.startswith(incomplete)]
 
-    if 'GLIDEIN_Resource_Slots' in entries[0]:
-        for slot_description in entries[0]['GLIDEIN_Resource_Slots'].split(";"):
-            slot_info = slot_description.split(",")
-            if slot_info[0] != 'GPUs':
-                continue
-            if len(slot_info) == 3:
-                if slot_info[1] == "1":
-                    print(f"- Entry has 1 GPU per glidein")
-                else:
-                    print(f"- Entry has {slot_info[1]} GPUs per glidein")
-            else:
-                print("- Entry has GPUs available to glidein")
-
-    print()
-
-    if entries[0].get('GLIDEIN_In_Downtime') == 'True':
-        click.echo(click.style("WARNING:", fg='red', bold=True) + " Entry point is currently in downtime\n")
-
-    for entry in entries:
-        click.echo("Data for OSPool group " + click.style(f"{entry['GlideGroupName']}", bold=True))
-
-        if 'GlideClientLimitTotalGlideinsPerGroup' in entry:
-            click.echo(click.style("WARNING:", fg='red', bold=True) +
-                f" Requests will be reduced due to group limit on total glideins: {entry['GlideClientLimitTotalGlideinsPerGroup']}")
-        if 'GlideClientLimitIdleGlideinsPerGroup' in entry:
-            click.echo(click.style("WARNING:", fg='red', bold=True) +
-                f" Requests will be reduced due to group limit on idle glideins: {entry['GlideClientLimitIdleGlideinsPerGroup']}")
-
-        print( "- Matching payload jobs:")
-        print(f"  - Idle:                          {entry['GlideClientMonitorJobsIdle']}")
-        print(f"  - Running at this entry:         {entry['GlideClientMonitorJobsRunningHere']}")
-        print(f"- Requests for glideins in the CE:")
-        print(f"  - Idle in CE queue:              {entry['GlideClientMonitorGlideinsRequestIdle']}")
-        if ('GlideFactoryMonitorRequestedIdle' in entry) and entry['GlideClientMonitorGlideinsRequestIdle'] != entry['GlideFactoryMonitorRequestedIdle']:
-            click.echo("    - " + click.style("WARNING", bold=True, fg='red') + f": Factory changed this to {entry['GlideFactoryMonitorRequestedIdle']}")
-        print(f"  - Limit:                         {entry['GlideClientMonitorGlideinsRequestMaxRun']}")
-        if ('GlideFactoryMonitorRequestedMaxGlideins' in entry) and entry['GlideClientMonitorGlideinsRequestMaxRun'] != entry['GlideFactoryMonitorRequestedMaxGlideins']:
-            click.echo("    - " + click.style("WARNING", bold=True, fg='red') + f": Factory changed this to {entry['GlideFactoryMonitorRequestedMaxGlideins']}")
-        if 'GlideFactoryMonitorStatusIdle' in entry or 'GlideFactoryMonitorStatusPending' in entry or 'GlideFactoryMonitorStatusRunning' in entry:
-            print( "- Created glideins for the CE:")
-            if 'GlideFactoryMonitorStatusPending' in entry:
-                print(f"  - Created and idle in factory    {entry['GlideFactoryMonitorStatusIdle']}")
-            if 'GlideFactoryMonitorStatusPending' in entry:
-                print(f"  - Idle in the CE's queue         {entry['GlideFactoryMonitorStatusPending']}")
-            if entry.get("GlideFactoryMonitorStatusHeld", 0):
-                click.echo("  - In an error state (\"held\")     " + click.style(f"{entry['GlideFactoryMonitorStatusHeld']}", fg='red', bold=True))
-            elif 'GlideFactoryMonitorStatusHeld' in entry:
-                print(f"  - In an error state (\"held\")     {entry['GlideFactoryMonitorStatusHeld']}")
-            if 'GlideFactoryMonitorStatusRunning' in entry:
-                print(f"  - Reported by CE as running      {entry['GlideFactoryMonitorStatusRunning']}")
-        print( "- Running glideins for this group connected to OSPool collector:")
-        print(f"  - Slots in collector:            {entry['GlideClientMonitorGlideinsRunning']}")
-        print(f"  - Slots without payloads:        {entry['GlideClientMonitorGlideinsIdle']}")
-        print()
+
+class FieldsType(click.ParamType):
+
+    name = "fields"
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, list):
+            return value
+        fields = [field.strip() for field in value.split(",") if field.strip()]
+        if not fields:
+            self.fail("expected a comma-separated list of fields", param, ctx)
+        return fields
+
+    def shell_complete(self, ctx, param, incomplete):
+        prefix, _, incomplete = incomplete.rpartition(",")
+        prefix = prefix + "," if prefix else ""
+        return [click.shell_completion.CompletionItem(prefix + name) for name in output_utils.show_fields if name.startswith(incomplete)]
 
 
 @click.command()
-@click.option("--output", default="human", help="Output formats")
-@click.option("--pool", default="flock.opensciencegrid.org", help="OSPool collector hostname.", type=PoolType(), show_default=True)
-@click.option("--factory", default="OSG", help="Name of OSG factory.", show_default=True, type=click.Choice(["OSG", "OSG-ITB"], case_sensitive=False))
+@click.option("--output", default="human", help="Output format.", show_default=True, type=click.Choice(["human", "table"] + output_utils.output_formats))
+@click.option("--pool", default=["flock.opensciencegrid.org"], help="OSPool collector hostname; may be given multiple times.", type=PoolType(), show_default=True, multiple=True)
+@click.option("--all-known-pools", default=False, help="Also query every pool used previously.", is_flag=True)
+@click.option("--timeout", default=30, help="Seconds to wait for each pool to respond.", show_default=True, type=click.IntRange(min=1))
+@click.option("--factory", default=["OSG"], help="Name of OSG factory; may be given multiple times.", show_default=True, type=click.Choice(["OSG", "OSG-ITB"], case_sensitive=False), multiple=True)
 @click.option("--resource", help="Show only entries from resources matching glob.", type=ResourceType())
 @click.option("--ce-hostname", help="Show only entries from CE hostnames matching glob.", type=CEHostnameType())
 @click.option("--gpus-only", default=False, help="Only show resources with GPUs.", is_flag=True)
+@click.option("--no-cache", "no_cache", default=False, help="Always query the collector instead of the local snapshot cache.", is_flag=True)
+@click.option("--max-age", type=click.IntRange(min=0), help="Maximum age, in seconds, of cached collector results to use (default: $OSPOOL_CACHE_MAX_AGE or 300).")
+@click.option("--pager/--no-pager", default=None, help="Page human-readable output (default: when it does not fit on the terminal).")
+@click.option("--fields", help="Comma-separated fields (derived fields such as EntryName, or ClassAd attributes) to print with --output table, json, jsonl, or csv.", type=FieldsType())
 @click.argument("entry_name", type=EntryType(), required=False)
-def show_pressure(pool, output, entry_name, factory, resource, ce_hostname, gpus_only):
+def show_pressure(pool, all_known_pools, timeout, output, entry_name, factory, resource, ce_hostname, gpus_only, no_cache, max_age, pager, fields):
+
+    if fields and output == "human":
+        raise click.UsageError("--fields requires --output table, json, jsonl, or csv.")
 
     filter_obj = query.EntryFilter(entry=entry_name, factory=factory, resource=resource, ce_hostname=ce_hostname, gpus_only=gpus_only)
+    pools = pools_from_params(pool, all_known_pools)
+    if output == "human":
+        projection_attrs = render.entry_attrs
+    elif output == "table":
+        if not fields:
+            fields = list(render.table_fields)
+            if len(pools) > 1:
+                fields.insert(1, 'Pool')
+        projection_attrs = render.table_attrs(fields)
+    else:
+        fields = fields or output_utils.show_fields
+        projection_attrs = projection.plan(fields)
+    entries = query.query_pools(pools, filter_obj, projection_attrs, timeout=timeout,
+        on_error=report_pool_error, use_cache=not no_cache, max_age=max_age)
+
+    if output not in ("human", "table"):
+        # Records are written as the ads arrive, so this stage includes the query.
+        with timing.stage("query and render"):
+            records = (output_utils.entry_record(entry, fields) for entry in entries)
+            output_utils.write_records(records, output, fields, sys.stdout)
+        return
 
-    entry_info = collections.defaultdict(list)
-    has_entry_name = entry_name is None
-    for entry in query.query_entries(pool, filter_obj, query.entry_info_projection):
-        tmp_entry_name = entry['GlideFactoryName'].split("@")[0]
-        if entry_name and fnmatch.fnmatch(tmp_entry_name.lower(), entry_name.lower()):
-            has_entry_name = True
-        entry_info[tmp_entry_name].append(entry)
+    entries = model.entries_from_ads(entries, model.extra_fields(fields) if output == "table" else ())
+    has_entry_name = entry_name is None or \
+        any(fnmatch.fnmatch(entry.name.lower(), entry_name.lower()) for entry in entries)
 
     if not has_entry_name:
         print(f"No data found for entry {entry_name}; does it exist?")
         return
 
-    for key, entries in entry_info.items():
-        print_human_friendly_entry(key, entries)
+    with timing.stage("render") as details:
+        if output == "table":
+            text = render.format_table(entries, fields)
+        else:
+            text = "".join(render.format_entry(entry, show_pool=len(pools) > 1, show_factory=len(factory) > 1)
+                for entry in entries)
+        details.ads = len(entries)
+        details.nbytes = len(text)
+    render.emit(text, pager)
 
 
 @click.command()
-@click.option("--pool", default="flock.opensciencegrid.org", help="OSPool collector hostname.", type=PoolType(), show_default=True)
+@click.option("--output", default="human", help="Output format.", show_default=True, type=click.Choice(["human"] + output_utils.output_formats))
+@click.option("--pool", default=["flock.opensciencegrid.org"], help="OSPool collector hostname; may be given multiple times.", type=PoolType(), show_default=True, multiple=True)
+@click.option("--all-known-pools", default=False, help="Also query every pool used previously.", is_flag=True)
+@click.option("--timeout", default=30, help="Seconds to wait for each pool to respond.", show_default=True, type=click.IntRange(min=1))
 @click.option("--gpus-only", default=False, help="Only show resources with GPUs.", is_flag=True)
 @click.option("--resource", help="Show only entries from resources matching glob.", type=ResourceType())
 @click.option("--ce-hostname", help="Show only entries from CE hostnames matching glob.", type=CEHostnameType())
-@click.option("--factory", default="OSG", help="Name of OSG factory.", show_default=True, type=click.Choice(["OSG", "OSG-ITB"], case_sensitive=False))
+@click.option("--factory", default=["OSG"], help="Name of OSG factory; may be given multiple times.", show_default=True, type=click.Choice(["OSG", "OSG-ITB"], case_sensitive=False), multiple=True)
+@click.option("--no-cache", "no_cache", default=False, help="Always query the collector instead of the local snapshot cache.", is_flag=True)
+@click.option("--max-age", type=click.IntRange(min=0), help="Maximum age, in seconds, of cached collector results to use (default: $OSPOOL_CACHE_MAX_AGE or 300).")
 @click.argument("entry_name", type=EntryType(), required=False)
-def list_entries(pool, gpus_only, resource, factory, ce_hostname, entry_name):
+def list_entries(output, pool, all_known_pools, timeout, gpus_only, resource, factory, ce_hostname, entry_name, no_cache, max_age):
 
     filter_obj = query.EntryFilter(gpus_only=gpus_only, resource=resource, entry=entry_name, factory=factory, ce_hostname=ce_hostname)
+    pools = pools_from_params(pool, all_known_pools)
+    fields = output_utils.list_fields if output != "human" else ['EntryName']
+    entries = query.query_pools(pools, filter_obj, projection.plan(fields), timeout=timeout, on_error=report_pool_error,
+        use_cache=not no_cache, max_age=max_age)
+
+    if output != "human":
+        def unique_records():
+            seen = set()
+            for entry in entries:
+                record = output_utils.entry_record(entry, output_utils.list_fields)
+                key = (record['Pool'], record['EntryName'], record['Factory'])
+                if key not in seen:
+                    seen.add(key)
+                    yield record
+        output_utils.write_records(unique_records(), output, output_utils.list_fields, sys.stdout)
+        return
 
     entry_names = set()
-    for entry in query.query_entries(pool, filter_obj, []):
-        if 'GlideFactoryName' in entry:
-            entry_names.add(entry['GlideFactoryName'].split("@")[0])
+    for entry in model.entries_from_ads(entries):
+        if entry.name:
+            entry_names.add((entry.name, entry.pool))
 
     entry_names = list(entry_names)
     entry_names.sort()
-    for entry in entry_names:
-        print(f"{entry}")
+    for entry, entry_pool in entry_names:
+        print(f"{entry} ({entry_pool})" if len(pools) > 1 else f"{entry}")
+
+
+def print_watch_changes(changes, show_all):
+
+    timestamp = time.strftime("%H:%M:%S")
+    for (entry_name, group), old_counters, new_counters in sorted(changes, key=lambda change: (change[0][0], change[0][1] or "")):
+        prefix = f"{timestamp} " + click.style(entry_name, bold=True) + f" [{group}]"
+        if new_counters is None:
+            click.echo(prefix + " " + click.style("no longer reported", fg='yellow'))
+            continue
+        fields = []
+        for label, value, delta in watch.counter_deltas(old_counters, new_counters):
+            if delta is None:
+                if show_all or old_counters is None:
+                    fields.append(f"{label} {value}")
+                continue
+            worse = delta > 0 if label == 'held' else False
+            fields.append(f"{label} {value} " + click.style(f"({delta:+d})", fg='red' if worse else None, bold=True))
+        if old_counters is None and not show_all:
+            prefix += " " + click.style("new", fg='green')
+        click.echo(prefix + ": " + ", ".join(fields))
+
+
+@click.command()
+@click.option("--pool", default="flock.opensciencegrid.org", help="OSPool collector hostname.", type=PoolType(), show_default=True)
+@click.option("--factory", default="OSG", help="Name of OSG factory.", show_default=True, type=click.Choice(["OSG", "OSG-ITB"], case_sensitive=False))
+@click.option("--resource", help="Show only entries from resources matching glob.", type=ResourceType())
+@click.option("--ce-hostname", help="Show only entries from CE hostnames matching glob.", type=CEHostnameType())
+@click.option("--gpus-only", default=False, help="Only show resources with GPUs.", is_flag=True)
+@click.option("--interval", default=60, help="Seconds between collector queries.", show_default=True, type=click.IntRange(min=5))
+@click.option("--count", type=click.IntRange(min=1), help="Exit after this many queries.")
+@click.argument("entry_name", type=EntryType(), required=False)
+def watch_pressure(pool, factory, resource, ce_hostname, gpus_only, interval, count, entry_name):
+    """
+    Poll the collector and print only the entries whose counters changed.
+    """
+
+    filter_obj = query.EntryFilter(entry=entry_name, factory=factory, resource=resource, ce_hostname=ce_hostname, gpus_only=gpus_only)
+
+    previous = None
+    iteration = 0
+    try:
+        while True:
+            started = time.monotonic()
+            try:
+                current = watch.take_snapshot(model.entries_from_ads(
+                    query.query_entries(pool, filter_obj, watch.watch_projection, use_cache=False)))
+            except Exception as exc:
+                click.echo(click.style("WARNING:", fg='red', bold=True) + f" Failed to query {pool}: {exc}", err=True)
+                current = None
+
+            if current is not None:
+                if previous is None and not current:
+                    print(f"No data found for entry {entry_name or '*'}; waiting for it to appear.")
+                print_watch_changes(watch.diff_snapshots(previous or {}, current), previous is None)
+                sys.stdout.flush()
+                previous = current
+
+            iteration += 1
+            if count is not None and iteration >= count:
+                break
+            time.sleep(max(interval - (time.monotonic() - started), 0))
+    except KeyboardInterrupt:
+        pass
+
+
+@click.command()
+@click.option("--pool", default=["flock.opensciencegrid.org"], help="OSPool collector hostname; may be given multiple times.", type=PoolType(), show_default=True, multiple=True)
+@click.option("--all-known-pools", default=False, help="Also query every pool used previously.", is_flag=True)
+@click.option("--timeout", default=30, help="Seconds to wait for each pool to respond.", show_default=True, type=click.IntRange(min=1))
+@click.option("--factory", default=["OSG"], help="Name of OSG factory; may be given multiple times.", show_default=True, type=click.Choice(["OSG", "OSG-ITB"], case_sensitive=False), multiple=True)
+@click.option("--retention", default="30d", help="Delete samples older than this.", show_default=True, type=DurationType())
+@click.option("--downsample-after", default="2d", help="Average samples older than this into hourly samples.", show_default=True, type=DurationType())
+@click.argument("entry_name", type=EntryType(), required=False)
+def record_history(pool, all_known_pools, timeout, factory, retention, downsample_after, entry_name):
+    """
+    Record the current counters of each entry in the local history database.
+
+    Intended to be run periodically, e.g., from cron.
+    """
+
+    filter_obj = query.EntryFilter(entry=entry_name, factory=factory)
+    pools = pools_from_params(pool, all_known_pools)
+    entries = query.query_pools(pools, filter_obj, history.history_projection, timeout=timeout,
+        on_error=report_pool_error, use_cache=False)
+
+    history.record_snapshot(model.entries_from_ads(entries))
+    history.prune_history(retention=retention, downsample_after=downsample_after)
+
+
+def print_history(samples):
+
+    columns = [
+        ('jobs_idle',        'Idle jobs'),
+        ('jobs_running',     'Running jobs'),
+        ('request_idle',     'Req. idle'),
+        ('status_pending',   'CE idle'),
+        ('status_running',   'CE running'),
+        ('status_held',      'Held'),
+        ('glideins_running', 'Slots'),
+        ('glideins_idle',    'Idle slots'),
+    ]
+
+    current_series = None
+    for sample in samples:
+        series = (sample['EntryName'], sample['Pool'], sample['Factory'], sample['GlideGroupName'])
+        if series != current_series:
+            current_series = series
+            factory_info = f", factory {sample['Factory']}" if sample['Factory'] else ""
+            click.echo("\nHistory for entry " + click.style(sample['EntryName'], bold=True) +
+                f" (pool {sample['Pool']}{factory_info}), OSPool group " + click.style(sample['GlideGroupName'], bold=True))
+            print(f"{'Time':<16}" + "".join(f"{label:>13}" for _, label in columns))
+        values = ["-" if sample[column] is None else str(sample[column]) for column, _ in columns]
+        print(time.strftime("%Y-%m-%d %H:%M", time.localtime(sample['Timestamp'])) + "".join(f"{value:>13}" for value in values))
+
+
+@click.command()
+@click.option("--output", default="human", help="Output format.", show_default=True, type=click.Choice(["human"] + output_utils.output_formats))
+@click.option("--since", default="24h", help="Show samples recorded within this long ago.", show_default=True, type=DurationType())
+@click.option("--pool", help="Only show samples from this pool.", type=PoolType())
+@click.option("--factory", help="Only show samples from this OSG factory.", type=click.Choice(["OSG", "OSG-ITB"], case_sensitive=False))
+@click.option("--group", help="Only show samples for OSPool groups matching glob.")
+@click.argument("entry_name")
+def show_history(output, since, pool, factory, group, entry_name):
+    """
+    Show the recorded counters for entries matching ENTRY_NAME.
+    """
+
+    samples = history.get_entry_history(entry_name, since, pool=pool, group=group, factory=factory)
+
+    if output != "human":
+        fields = ['Pool', 'EntryName', 'Factory', 'GlideGroupName', 'Timestamp', 'Samples'] + history.history_columns
+        output_utils.write_records(samples, output, fields, sys.stdout)
+        return
+
+    if not samples:
+        print(f"No history recorded for entry {entry_name} in that time; has `ospool record` been run?")
+        return
+
+    print_history(samples)
+
+
+def print_summary_table(title, key_label, rows):
+
+    key_width = max([len(key_label)] + [len(str(key)) for key, _ in rows])
+    click.echo(click.style(title, bold=True))
+    print(f"{key_label:<{key_width}}{'Ads':>7}" + "".join(f"{label:>11}" for _, label in summary.summary_counters))
+    for key, acc in rows:
+        print(f"{key:<{key_width}}{acc[summary.AD_COUNT]:>7}" + "".join(f"{value:>11}" for value in acc[:summary.AD_COUNT]))
+
+
+@click.command()
+@click.option("--output", default="human", help="Output format.", show_default=True, type=click.Choice(["human"] + output_utils.output_formats))
+@click.option("--pool", default=["flock.opensciencegrid.org"], help="OSPool collector hostname; may be given multiple times.", type=PoolType(), show_default=True, multiple=True)
+@click.option("--all-known-pools", default=False, help="Also query every pool used previously.", is_flag=True)
+@click.option("--timeout", default=30, help="Seconds to wait for each pool to respond.", show_default=True, type=click.IntRange(min=1))
+@click.option("--factory", default=["OSG"], help="Name of OSG factory; may be given multiple times.", show_default=True, type=click.Choice(["OSG", "OSG-ITB"], case_sensitive=False), multiple=True)
+@click.option("--resource", help="Show only entries from resources matching glob.", type=ResourceType())
+@click.option("--ce-hostname", help="Show only entries from CE hostnames matching glob.", type=CEHostnameType())
+@click.option("--gpus-only", default=False, help="Only show resources with GPUs.", is_flag=True)
+@click.option("--by", "group_by", default="resource", help="Aggregate the counters by this attribute.", show_default=True, type=click.Choice(list(summary.group_by_keys)))
+@click.option("--rank-by", default="idle-ratio", help="Pressure metric used to rank entries.", show_default=True, type=click.Choice(list(summary.rank_metrics)))
+@click.option("--top", default=10, help="Number of entries to rank.", show_default=True, type=click.IntRange(min=0))
+@click.option("--no-cache", "no_cache", default=False, help="Always query the collector instead of the local snapshot cache.", is_flag=True)
+@click.option("--max-age", type=click.IntRange(min=0), help="Maximum age, in seconds, of cached collector results to use (default: $OSPOOL_CACHE_MAX_AGE or 300).")
+@click.argument("entry_name", type=EntryType(), required=False)
+def show_summary(output, pool, all_known_pools, timeout, factory, resource, ce_hostname, gpus_only, group_by, rank_by, top, no_cache, max_age, entry_name):
+    """
+    Aggregate entry counters across the pool and rank the most starved entries.
+    """
+
+    filter_obj = query.EntryFilter(entry=entry_name, factory=factory, resource=resource, ce_hostname=ce_hostname, gpus_only=gpus_only)
+    pools = pools_from_params(pool, all_known_pools)
+    entries = query.query_pools(pools, filter_obj, summary.summary_projection, timeout=timeout,
+        on_error=report_pool_error, use_cache=not no_cache, max_age=max_age)
+
+    groups, per_entry = summary.aggregate(model.entries_from_ads(entries), group_by)
+    group_rows = sorted(groups.items(), key=lambda row: (-row[1][0], str(row[0])))
+    ranked = summary.rank_entries(per_entry, rank_by, top)
+
+    if output != "human":
+        counter_fields = [attr for attr, _ in summary.summary_counters]
+        fields = ['Section', 'Key', 'Pool', 'Factory', 'Score', 'Ads'] + counter_fields
+        def records():
+            for key, acc in group_rows:
+                yield dict([('Section', group_by), ('Key', key), ('Pool', None), ('Factory', None), ('Score', None),
+                    ('Ads', acc[summary.AD_COUNT])] + list(zip(counter_fields, acc)))
+            for score, (entry_pool, key, entry_factory), acc in ranked:
+                yield dict([('Section', 'top-' + rank_by), ('Key', key), ('Pool', entry_pool), ('Factory', entry_factory), ('Score', score),
+                    ('Ads', acc[summary.AD_COUNT])] + list(zip(counter_fields, acc)))
+        output_utils.write_records(records(), output, fields, sys.stdout)
+        return
+
+    if not groups:
+        print("No entries matched the given filters.")
+        return
+
+    total = summary.total(acc for _, acc in group_rows)
+    print_summary_table(f"Counters by {group_by} across {len(per_entry)} entries", group_by.capitalize(), group_rows + [("Total", total)])
+
+    if ranked:
+        show_factory = len(factory) > 1
+        print()
+        print_summary_table(f"Top {len(ranked)} entries by {summary.rank_metrics[rank_by][0]}", "Entry",
+            [(key + (f" [{entry_pool}]" if len(pools) > 1 else "") + (f" ({entry_factory})" if show_factory else "") +
+                f" ({score:.2f})", acc)
+                for score, (entry_pool, key, entry_factory), acc in ranked])
+
+
+def print_slots_table(rows):
+
+    key_width = max([len("Entry")] + [len(key) for key, _ in rows])
+    print(f"{'Entry':<{key_width}}" + "".join(f"{label:>11}" for _, label in slots.slot_counters[:slots.IDLE_AGE_TOTAL]) +
+        f"{'Avg idle':>11}{'Max idle':>11}")
+    for key, acc in rows:
+        average_age = slots.average_idle_age(acc)
+        print(f"{key:<{key_width}}" + "".join(f"{value:>11}" for value in acc[:slots.IDLE_AGE_TOTAL]) +
+            f"{slots.format_age(average_age):>11}" +
+            f"{slots.format_age(acc[slots.IDLE_AGE_MAX] if average_age is not None else None):>11}")
+
+
+@click.command()
+@click.option("--output", default="human", help="Output format.", show_default=True, type=click.Choice(["human"] + output_utils.output_formats))
+@click.option("--pool", default=["flock.opensciencegrid.org"], help="OSPool collector hostname; may be given multiple times.", type=PoolType(), show_default=True, multiple=True)
+@click.option("--all-known-pools", default=False, help="Also query every pool used previously.", is_flag=True)
+@click.option("--timeout", default=30, help="Seconds to wait for each pool to respond.", show_default=True, type=click.IntRange(min=1))
+@click.option("--factory", default=["OSG"], help="Name of OSG factory; may be given multiple times.", show_default=True, type=click.Choice(["OSG", "OSG-ITB"], case_sensitive=False), multiple=True)
+@click.option("--resource", help="Show only entries from resources matching glob.", type=ResourceType())
+@click.option("--ce-hostname", help="Show only entries from CE hostnames matching glob.", type=CEHostnameType())
+@click.option("--gpus-only", default=False, help="Only show resources with GPUs.", is_flag=True)
+@click.option("--no-cache", "no_cache", default=False, help="Always query the collector instead of the local snapshot cache.", is_flag=True)
+@click.option("--max-age", type=click.IntRange(min=0), help="Maximum age, in seconds, of cached collector results to use (default: $OSPOOL_CACHE_MAX_AGE or 300).")
+@click.argument("entry_name", type=EntryType(), required=False)
+def show_slots(output, pool, all_known_pools, timeout, factory, resource, ce_hostname, gpus_only, no_cache, max_age, entry_name):
+    """
+    Count the glidein slots of each entry and the cores, GPUs, and memory they hold.
+    """
+
+    filter_obj = query.EntryFilter(entry=entry_name, factory=factory, resource=resource, ce_hostname=ce_hostname, gpus_only=gpus_only)
+    pools = pools_from_params(pool, all_known_pools)
+    entries = model.entries_from_ads(query.query_pools(pools, filter_obj, projection.plan(['EntryName']), timeout=timeout,
+        on_error=report_pool_error, use_cache=not no_cache, max_age=max_age))
+    entries.sort(key=lambda entry: (entry.name, entry.pool or "", entry.factory or ""))
+
+    # Startd ads change too quickly, and are too numerous, to be worth caching.
+    table, unmatched = slots.join_slots(entries, filter_obj, on_error=report_pool_error)
+    rows = [(entry, table[slots.entry_key(entry)]) for entry in entries]
+
+    if output != "human":
+        counter_fields = [name for name, _ in slots.slot_counters]
+        fields = ['Pool', 'EntryName', 'Factory'] + counter_fields + ['idle_age_avg']
+        records = (dict([('Pool', entry.pool), ('EntryName', entry.name), ('Factory', entry.factory)] +
+                list(zip(counter_fields, acc)) + [('idle_age_avg', slots.average_idle_age(acc))])
+            for entry, acc in rows)
+        output_utils.write_records(records, output, fields, sys.stdout)
+        return
+
+    if not rows:
+        print("No entries matched the given filters.")
+        return
+
+    show_factory = len(factory) > 1
+    print_slots_table([(entry.name + (f" [{entry.pool}]" if len(pools) > 1 else "") + (f" ({entry.factory})" if show_factory else ""), acc)
+        for entry, acc in rows] + [("Total", slots.total(acc for _, acc in rows))])
+    if unmatched:
+        print(f"\n{unmatched} glidein slots did not match any of the selected entries.")
+
+
+@click.command()
+@click.option("--pool", default=["flock.opensciencegrid.org"], help="OSPool collector hostname; may be given multiple times.", type=PoolType(), show_default=True, multiple=True)
+@click.option("--interval", default=server.DEFAULT_INTERVAL, help="Seconds between collector queries.", show_default=True, type=click.IntRange(min=1))
+@click.option("--socket", "socket_path", help="Unix socket to listen on (default: $OSPOOL_SERVER_SOCKET or server.sock in the ospool state directory).", type=click.Path(dir_okay=False))
+def serve_queries(pool, interval, socket_path):
+    """
+    Keep each pool's entries in memory and answer the queries of other ospool commands.
+    """
+
+    socket_path = socket_path or backend.get_server_socket_paths()[-1]
+    pools = pools_from_params(pool)
+    # Exit through the finally clauses, so the socket is removed.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    def report_ready():
+        click.echo(f"Serving {', '.join(pools)} on {socket_path}, refreshing every {interval} seconds", err=True)
+
+    try:
+        server.serve(socket_path, pools, interval, on_error=report_pool_error, on_ready=report_ready)
+    except RuntimeError as exc:
+        raise click.ClickException(str(exc))
+    except KeyboardInterrupt:
+        pass
 
 
 ospool.add_command(list_entries, name="list-entries")
 ospool.add_command(show_pressure, name="show")
+ospool.add_command(watch_pressure, name="watch")
+ospool.add_command(show_summary, name="summary")
+ospool.add_command(record_history, name="record")
+ospool.add_command(show_history, name="history")
+ospool.add_command(show_slots, name="slots")
+ospool.add_command(serve_queries, name="serve")
@@ -0,0 +1,226 @@
+"""Typed records of factory entries and their groups, parsed once from glideresource ads
+
+`entries_from_ads` turns the ads returned by `ospool.utils.query.query_pools` into
+`Entry` objects, each holding a `GroupPressure` per frontend group::
+
+    import ospool.model as model
+    import ospool.utils.query as query
+
+    ads = query.query_pools(pools, query.EntryFilter(factory="OSG"), model.projection)
+    for entry in model.entries_from_ads(ads):
+        print(entry.name, entry.ce_host, sum(group.jobs_idle or 0 for group in entry.groups))
+"""
+
+import ospool.utils.cache as cache
+import ospool.utils.query as query
+
+
+# Counters parsed from each ad: (ClassAd attribute, GroupPressure attribute).  Counters
+# missing from the ad, or not integers, are None.
+counters = [
+    ('GlideClientMonitorJobsIdle',              'jobs_idle'),
+    ('GlideClientMonitorJobsRunningHere',       'jobs_running'),
+    ('GlideClientMonitorGlideinsRequestIdle',   'request_idle'),
+    ('GlideClientMonitorGlideinsRequestMaxRun', 'request_max_run'),
+    ('GlideFactoryMonitorRequestedIdle',        'factory_request_idle'),
+    ('GlideFactoryMonitorRequestedMaxGlideins', 'factory_request_max'),
+    ('GlideFactoryMonitorStatusIdle',           'status_idle'),
+    ('GlideFactoryMonitorStatusPending',        'status_pending'),
+    ('GlideFactoryMonitorStatusRunning',        'status_running'),
+    ('GlideFactoryMonitorStatusHeld',           'status_held'),
+    ('GlideClientMonitorGlideinsRunning',       'glideins_running'),
+    ('GlideClientMonitorGlideinsIdle',          'glideins_idle'),
+]
+
+# Limits which reduce the requests of every group at the entry, in the order reported.
+entry_limit_attrs = [
+    'GlideClientLimitTotalGlideinsPerEntry',
+    'GlideClientLimitIdleGlideinsPerEntry',
+    'GlideClientLimitTotalGlideinsPerFrontend',
+    'GlideClientLimitIdleGlideinsPerFrontend',
+    'GlideClientLimitTotalGlideinsGlobal',
+    'GlideClientLimitIdleGlideinsGlobal',
+    'GlideFactoryMonitorStatus_GlideFactoryLimitTotalGlideinsPerEntry',
+    'GlideFactoryMonitorStatus_GlideFactoryLimitIdleGlideinsPerEntry',
+    'GlideFactoryMonitorStatus_GlideFactoryLimitHeldGlideinsPerEntry',
+]
+
+# Limits which reduce the requests of a single group.
+group_limit_attrs = [
+    'GlideClientLimitTotalGlideinsPerGroup',
+    'GlideClientLimitIdleGlideinsPerGroup',
+]
+
+# Every attribute parsed into an Entry or GroupPressure.
+projection = [
+    'GlideFactoryName',
+    'GlideGroupName',
+    'GLIDEIN_ResourceName',
+    'GLIDEIN_Gatekeeper',
+    'GLIDEIN_CPUS',
+    'GLIDEIN_ESTIMATED_CPUS',
+    'GLIDEIN_Resource_Slots',
+    'GLIDEIN_In_Downtime',
+] + [attr for attr, _ in counters] + entry_limit_attrs + group_limit_attrs
+
+# Output fields and ClassAd attributes available from an Entry or a GroupPressure.
+entry_fields = {
+    'Pool':                 'pool',
+    'EntryName':            'name',
+    'Factory':              'factory',
+    'CEHostname':           'ce_host',
+    'GLIDEIN_ResourceName': 'resource',
+}
+group_fields = dict(counters, GlideGroupName='name')
+
+
+def _int(value):
+    # An exact type check also rejects booleans.
+    return value if type(value) is int else None
+
+
+def _str(value):
+    return value if isinstance(value, str) else None
+
+
+def _limits(ad, attrs):
+    # Almost always empty, so a shared empty tuple is cheaper than a dict per ad.
+    return tuple((attr, ad[attr]) for attr in attrs if attr in ad)
+
+
+def split_factory_name(factory_name):
+    """
+    Split a `GlideFactoryName` such as `OSG_US_Entry@gfactory_instance@OSG` into the
+    entry name and the factory (None when the name has no `@`).
+    """
+    name, sep, factory = factory_name.rpartition("@")
+    if not sep:
+        return factory_name, None
+    return factory_name.split("@", 1)[0], factory
+
+
+def ce_hostname(gatekeeper):
+    """
+    Return the CE hostname from a `GLIDEIN_Gatekeeper` such as `ce.example.org
+    ce.example.org:9619`, or None if there is none.
+    """
+    return gatekeeper.split(" ", 1)[0] if isinstance(gatekeeper, str) and gatekeeper else None
+
+
+class GroupPressure(object):
+    """
+    The counters and limits of one frontend group at an entry, from a single ad.
+    `extra` holds any additional attributes requested from `entries_from_ads`, as
+    JSON-compatible values.
+    """
+
+    __slots__ = ['name', 'limits', 'extra'] + [slot for _, slot in counters]
+
+    def __init__(self, ad, extra_attrs=()):
+        self.name = _str(ad.get('GlideGroupName'))
+        for attr, slot in counters:
+            setattr(self, slot, _int(ad.get(attr)))
+        self.limits = _limits(ad, group_limit_attrs)
+        self.extra = {attr: cache.to_json_value(ad.get(attr)) for attr in extra_attrs} if extra_attrs else None
+
+    def factory_changed_request(self):
+        """
+        Return True if the factory lowered the requested idle or maximum glideins.
+        """
+        return (self.factory_request_idle is not None and self.request_idle != self.factory_request_idle) or \
+            (self.factory_request_max is not None and self.request_max_run != self.factory_request_max)
+
+    def __repr__(self):
+        return "GroupPressure({!r}, jobs_idle={!r}, glideins_running={!r})".format(
+            self.name, self.jobs_idle, self.glideins_running)
+
+
+class Entry(object):
+    """
+    A factory entry as seen by one pool, with a GroupPressure for each frontend group.
+
+    `cpus` is the cores per glidein (None for whole-node entries, where `whole_node` is
+    set and `estimated_cpus` may hold an estimate) and `gpus` has one item per GPU slot
+    layout: the GPUs per glidein, or None if unspecified.
+    """
+
+    __slots__ = ['name', 'factory', 'pool', 'resource', 'gatekeeper', 'ce_host', 'cpus', 'whole_node',
+        'estimated_cpus', 'gpus', 'in_downtime', 'limits', 'groups']
+
+    def __init__(self, ad, name=None, factory=None):
+        if name is None:
+            name, factory = split_factory_name(ad.get('GlideFactoryName') or "")
+        self.name = name
+        self.factory = factory
+        self.pool = ad.get(query.source_pool_attr)
+        self.resource = _str(ad.get('GLIDEIN_ResourceName'))
+        self.gatekeeper = _str(ad.get('GLIDEIN_Gatekeeper'))
+        self.ce_host = ce_hostname(self.gatekeeper)
+
+        cpus = ad.get('GLIDEIN_CPUS')
+        self.whole_node = cpus == "auto"
+        try:
+            self.cpus = None if self.whole_node or cpus is None else int(cpus)
+        except (TypeError, ValueError):
+            self.cpus = None
+        self.estimated_cpus = _int(ad.get('GLIDEIN_ESTIMATED_CPUS'))
+
+        gpus = []
+        for slot_description in (_str(ad.get('GLIDEIN_Resource_Slots')) or "").split(";"):
+            slot_info = slot_description.split(",")
+            if slot_info[0] != 'GPUs':
+                continue
+            gpus.append(int(slot_info[1]) if len(slot_info) == 3 and slot_info[1].isdigit() else None)
+        self.gpus = tuple(gpus)
+
+        downtime = ad.get('GLIDEIN_In_Downtime')
+        self.in_downtime = downtime is True or downtime == 'True'
+        self.limits = _limits(ad, entry_limit_attrs)
+        self.groups = []
+
+    @property
+    def has_gpus(self):
+        return bool(self.gpus)
+
+    def __repr__(self):
+        return "Entry({!r}, factory={!r}, pool={!r}, groups={!r})".format(
+            self.name, self.factory, self.pool, [group.name for group in self.groups])
+
+
+def entries_from_ads(ads, extra_attrs=()):
+    """
+    Return a list of Entry objects, one per (entry name, pool, factory) in the order
+    first seen, each with a GroupPressure for every one of its ads.  The entry's own
+    fields are parsed from its first ad only.
+    """
+    entries = {}
+    for ad in ads:
+        factory_name = ad.get('GlideFactoryName') or ""
+        name, factory = split_factory_name(factory_name)
+        key = (name, ad.get(query.source_pool_attr), factory)
+        entry = entries.get(key)
+        if entry is None:
+            entry = entries[key] = Entry(ad, name, factory)
+        entry.groups.append(GroupPressure(ad, extra_attrs))
+    return list(entries.values())
+
+
+def extra_fields(fields):
+    """
+    Return the items of `fields` which are not parsed into an Entry or GroupPressure.
+    """
+    return [field for field in fields if field not in entry_fields and field not in group_fields]
+
+
+def field_value(entry, group, field):
+    """
+    Return the value of the output field or ClassAd attribute `field` for a group of
+    `entry`; fields listed by `extra_fields` must have been requested as extra attributes.
+    """
+    slot = entry_fields.get(field)
+    if slot is not None:
+        return getattr(entry, slot)
+    slot = group_fields.get(field)
+    if slot is not None:
+        return getattr(group, slot)
+    return group.extra.get(field) if group.extra else None
@@ -0,0 +1,157 @@
+"""Pluggable collector backends used to run queries"""
+
+import json
+import os
+import socket
+
+import classad
+
+import ospool.utils.config as config
+
+
+class HTCondorCollector(object):
+    """
+    Query a live HTCondor collector; the default backend.
+    """
+
+    # Names of the htcondor.AdTypes members; htcondor is only imported when a query
+    # is made, since clients answered by `ospool serve` never need it.
+    ad_types = {
+        'any': 'Any',
+        'startd': 'Startd',
+    }
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def query(self, ad_type, constraint, projection):
+        import htcondor
+
+        collector = htcondor.Collector(self.pool)
+        return collector.query(ad_type=getattr(htcondor.AdTypes, self.ad_types[ad_type]),
+                        constraint=constraint,
+                        projection=list(projection))
+
+
+# Parsed fixture files, keyed by (path, modification time), shared by all FileCollectors.
+_file_ads = {}
+
+
+def _load_file_ads(path):
+    key = (path, os.stat(path).st_mtime)
+    ads = _file_ads.get(key)
+    if ads is not None:
+        return ads
+
+    with open(path) as fp:
+        if path.endswith(".json"):
+            ads = [classad.ClassAd(ad) for ad in json.load(fp)]
+        elif path.endswith(".jsonl"):
+            ads = [classad.ClassAd(json.loads(line)) for line in fp if line.strip()]
+        else:
+            # ClassAds in the format printed by `condor_status -long`.
+            ads = list(classad.parseAds(fp))
+    _file_ads.clear()
+    _file_ads[key] = ads
+    return ads
+
+
+class FileCollector(object):
+    """
+    Replay ads recorded in a file instead of contacting a collector.
+
+    The file may be a JSON list of ads, one JSON ad per line (`.jsonl`), or ClassAds as
+    printed by `condor_status -long`.  The constraint and projection are applied as a
+    collector would; the ad type is ignored, so the constraint should check `MyType`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def query(self, ad_type, constraint, projection):
+        expr = classad.ExprTree(constraint) if constraint else None
+        projection = list(projection)
+        results = []
+        for ad in _load_file_ads(self.path):
+            if expr is not None and expr.eval(ad) is not True:
+                continue
+            if projection:
+                projected = classad.ClassAd()
+                for attr in projection:
+                    if attr in ad:
+                        projected[attr] = ad.lookup(attr)
+                ad = projected
+            results.append(ad)
+        return results
+
+
+_backends = {
+    'file': FileCollector,
+}
+
+
+def register_backend(scheme, factory):
+    """
+    Route pools named `<scheme>:<location>` to `factory(location)`, which must return an
+    object with the same `query` method as `HTCondorCollector`.
+    """
+    _backends[scheme] = factory
+
+
+def get_collector(pool):
+    """
+    Return the collector backend for `pool`; pools without a registered scheme prefix
+    (such as `flock.opensciencegrid.org:9618`) use HTCondor.
+    """
+    scheme, sep, location = pool.partition(":")
+    if sep and scheme in _backends:
+        return _backends[scheme](location)
+    return HTCondorCollector(pool)
+
+
+# Version of the request and response format spoken with `ospool serve`.
+SERVER_PROTOCOL_VERSION = 1
+
+# Seconds to wait for `ospool serve` to answer before querying the collector directly.
+SERVER_TIMEOUT = 10
+
+
+def get_server_socket_paths():
+    """
+    Return the Unix socket paths where a running `ospool serve` is looked for: the
+    system-wide socket, then the user's own.  $OSPOOL_SERVER_SOCKET replaces both.
+    """
+    if os.environ.get("OSPOOL_SERVER_SOCKET"):
+        return [os.environ["OSPOOL_SERVER_SOCKET"]]
+    return ["/run/ospool/server.sock", str(config._get_state_dir() / "server.sock")]
+
+
+def query_server(pool, constraint, projection, max_age=None):
+    """
+    Ask a running `ospool serve` for the glideresource ads of `pool` matching the query.
+    Returns the ads as dictionaries, or None if no server answered for the pool with a
+    snapshot younger than `max_age` seconds.
+    """
+    request = json.dumps({
+        "version": SERVER_PROTOCOL_VERSION,
+        "pool": pool,
+        "constraint": constraint,
+        "projection": sorted(projection),
+        "max_age": max_age,
+    }).encode() + b"\n"
+
+    for path in get_server_socket_paths():
+        if not os.path.exists(path):
+            continue
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(SERVER_TIMEOUT)
+                sock.connect(path)
+                sock.sendall(request)
+                with sock.makefile("rb") as fp:
+                    response = json.loads(fp.readline())
+        except (OSError, ValueError):
+            continue
+        if isinstance(response, dict) and isinstance(response.get("ads"), list):
+            return response["ads"]
+    return None
@@ -0,0 +1,255 @@
+"""On-disk snapshot cache for collector query results"""
+
+import hashlib
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import classad
+
+import ospool.utils.config as config
+import ospool.utils.timing as timing
+
+
+# Snapshots younger than this many seconds are returned without contacting the collector.
+DEFAULT_MAX_AGE = 300
+
+# Snapshots older than the max age - but within this many additional seconds - are still
+# returned while a fresh snapshot is fetched in the background.
+DEFAULT_STALE_AGE = 3600
+
+# A background refresh that has not finished after this many seconds is assumed dead.
+REFRESH_LOCK_TIMEOUT = 120
+
+SNAPSHOT_VERSION = 1
+
+
+def _get_env_seconds(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        return default
+
+
+def get_max_age():
+    """
+    Return the default snapshot TTL in seconds; can be overridden with $OSPOOL_CACHE_MAX_AGE.
+    """
+    return _get_env_seconds("OSPOOL_CACHE_MAX_AGE", DEFAULT_MAX_AGE)
+
+
+def get_stale_age():
+    """
+    Return how long past its TTL a snapshot may be served while it is refreshed; can be
+    overridden with $OSPOOL_CACHE_STALE_AGE.
+    """
+    return _get_env_seconds("OSPOOL_CACHE_STALE_AGE", DEFAULT_STALE_AGE)
+
+
+def _get_cache_dir():
+    cache_dir = config._get_state_dir() / "cache"
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    return cache_dir
+
+
+def _snapshot_path(pool, projection, constraint):
+    key = json.dumps([pool.lower(), sorted(projection), constraint])
+    return _get_cache_dir() / "{}.json".format(hashlib.sha256(key.encode()).hexdigest()[:32])
+
+
+def to_json_value(value):
+    """
+    Convert a ClassAd attribute value into a JSON-compatible value, or None if it is
+    undefined or an error.
+    """
+    if isinstance(value, classad.ExprTree):
+        value = value.eval()
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, classad.ClassAd):
+        return _ad_to_dict(value)
+    if isinstance(value, list):
+        return [to_json_value(item) for item in value]
+    return None
+
+
+def _ad_to_dict(ad):
+    result = {}
+    for key in ad.keys():
+        value = to_json_value(ad[key])
+        if value is not None:
+            result[key] = value
+    return result
+
+
+def prune_snapshots(max_age=None, stale_age=None):
+    """
+    Delete snapshots too old to be served (older than `max_age` plus `stale_age`), along
+    with leftover temporary files.  Snapshots are keyed by the query, so without this
+    every distinct filter or projection would leave a file behind forever.
+    """
+    if max_age is None:
+        max_age = get_max_age()
+    if stale_age is None:
+        stale_age = get_stale_age()
+    cutoff = time.time() - max_age - stale_age
+    cache_dir = _get_cache_dir()
+    try:
+        names = os.listdir(str(cache_dir))
+    except OSError:
+        return
+    for name in names:
+        if not (name.endswith(".json") or name.startswith(".snapshot-")):
+            continue
+        path = str(cache_dir / name)
+        try:
+            if os.stat(path).st_mtime < cutoff:
+                os.unlink(path)
+        except OSError:
+            pass
+
+
+def load_snapshot(pool, projection, constraint):
+    """
+    Return a tuple of (creation time, list of ads) for the cached snapshot or None
+    if there is no usable snapshot on disk.
+    """
+    try:
+        with timing.stage("cache load") as details, open(_snapshot_path(pool, projection, constraint)) as fp:
+            snapshot = json.load(fp)
+            details.nbytes = fp.tell()
+            details.ads = len(snapshot.get("ads", [])) if isinstance(snapshot, dict) else None
+    except (OSError, ValueError):
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    return snapshot["created"], snapshot["ads"]
+
+
+def store_snapshot(pool, projection, constraint, ads):
+    """
+    Atomically write a snapshot of the query results; returns the ads as stored.
+    """
+    path = _snapshot_path(pool, projection, constraint)
+    with timing.stage("classad conversion") as details:
+        ads = [_ad_to_dict(ad) if isinstance(ad, classad.ClassAd) else ad for ad in ads]
+        details.ads = len(ads)
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "pool": pool,
+        "projection": sorted(projection),
+        "constraint": constraint,
+        "created": time.time(),
+        "ads": ads,
+    }
+    fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=".snapshot-")
+    try:
+        with timing.stage("cache write"), os.fdopen(fd, "w") as fp:
+            json.dump(snapshot, fp, separators=(",", ":"))
+        os.replace(tmp_path, str(path))
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+    prune_snapshots()
+    return ads
+
+
+def _acquire_refresh_lock(lock_path):
+    try:
+        fd = os.open(str(lock_path), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+    except FileExistsError:
+        try:
+            if time.time() - os.stat(str(lock_path)).st_mtime < REFRESH_LOCK_TIMEOUT:
+                return False
+            os.unlink(str(lock_path))
+        except OSError:
+            return False
+        return _acquire_refresh_lock(lock_path)
+    except OSError:
+        return False
+    os.close(fd)
+    return True
+
+
+def _refresh_in_background(pool, projection, constraint, query_func):
+    """
+    Start a detached process which re-runs the query and replaces the snapshot.  At most
+    one refresh per snapshot runs at a time.
+
+    Queries run in worker threads, so forking this process is unsafe (a thread may hold
+    a lock the child would need); a fresh interpreter is started instead.
+    """
+    lock_path = _snapshot_path(pool, projection, constraint).with_suffix(".refresh")
+    if not _acquire_refresh_lock(lock_path):
+        return
+
+    request = json.dumps({
+        "pool": pool,
+        "projection": list(projection),
+        "constraint": constraint,
+        "query_func": [query_func.__module__, query_func.__name__],
+        "lock": str(lock_path),
+    })
+    try:
+        # A new session and no shared file descriptors, so the parent (and any shell
+        # waiting on its output, as in tab completion) can exit immediately.
+        subprocess.Popen([sys.executable, "-c", "import ospool.utils.cache as cache, sys; cache._refresh_main(sys.argv[1])", request],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            close_fds=True, start_new_session=True)
+    except OSError:
+        try:
+            os.unlink(str(lock_path))
+        except OSError:
+            pass
+
+
+def _refresh_main(request):
+    """
+    Entry point of the process started by `_refresh_in_background`.
+    """
+    request = json.loads(request)
+    try:
+        module_name, func_name = request["query_func"]
+        query_func = getattr(importlib.import_module(module_name), func_name)
+        pool, projection, constraint = request["pool"], request["projection"], request["constraint"]
+        store_snapshot(pool, projection, constraint, query_func(pool, constraint, projection))
+    finally:
+        try:
+            os.unlink(request["lock"])
+        except OSError:
+            pass
+
+
+def cached_query(pool, projection, constraint, query_func, max_age=None, stale_age=None):
+    """
+    Return the ads matching the query, using an on-disk snapshot when possible.
+
+    `query_func(pool, constraint, projection)` is invoked to contact the collector
+    whenever the snapshot is missing or too old.  Snapshots older than `max_age` but
+    within `stale_age` are served immediately while a background refresh runs.
+    """
+    if max_age is None:
+        max_age = get_max_age()
+    if stale_age is None:
+        stale_age = get_stale_age()
+
+    snapshot = load_snapshot(pool, projection, constraint)
+    if snapshot is not None and max_age > 0:
+        created, ads = snapshot
+        age = time.time() - created
+        if 0 <= age <= max_age:
+            return ads
+        if 0 <= age <= max_age + stale_age:
+            _refresh_in_background(pool, projection, constraint, query_func)
+            return ads
+
+    return store_snapshot(pool, projection, constraint, query_func(pool, constraint, projection))
@@ -1,9 +1,14 @@
 """Tools for retrieving the user's configs for the ospool tools"""
 
+import atexit
+import json
 import sqlite3
 import os
 import pwd
 import pathlib
+import tempfile
+import threading
+import time
 
 
 def _get_home_dir():
@@ -23,42 +28,218 @@ def _get_state_dir():
      return state_base
 
 
-def _get_state_db(read_only=False):
-     if read_only:
-         conn = sqlite3.connect("file:{}?mode=ro".format(_get_state_dir() / "state.db"), uri=True)
-     else:
-         conn = sqlite3.connect(str(_get_state_dir() / "state.db"))
+# Filesystems where SQLite's file locking (and the shared memory used by WAL mode) is
+# unreliable or slow.
+_network_filesystems = {
+    "nfs", "nfs4", "cifs", "smb3", "smbfs", "afs", "lustre", "gpfs", "beegfs",
+    "ceph", "fuse.sshfs", "fuse.glusterfs", "9p",
+}
 
-     with conn:
-         all_tables = set(row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'"))
-         if 'pool_history' not in all_tables:
-             conn.execute("CREATE TABLE pool_history (name text)")
+# Process-wide state, shared by every thread; guarded by _state_lock.
+_state_lock = threading.RLock()
+_state_db = None
+_pool_usage = None
+_pending_pools = []
+_flush_registered = False
+_state_on_network_fs = None
 
-     return conn
+
+def _get_filesystem_type(path):
+    """
+    Return the type of the filesystem containing `path` according to /proc/mounts,
+    or None if it cannot be determined (e.g., not on Linux).
+    """
+    try:
+        with open("/proc/mounts") as fp:
+            mounts = [line.split() for line in fp]
+    except OSError:
+        return None
+
+    path = os.path.realpath(str(path))
+    best_mount, best_type = "", None
+    for fields in mounts:
+        if len(fields) < 3:
+            continue
+        mount_point = fields[1].replace("\\040", " ")
+        if (path == mount_point or path.startswith(mount_point.rstrip("/") + "/")) and len(mount_point) >= len(best_mount):
+            best_mount, best_type = mount_point, fields[2]
+    return best_type
+
+
+def _is_network_filesystem():
+    global _state_on_network_fs
+    if _state_on_network_fs is None:
+        _state_on_network_fs = _get_filesystem_type(_get_state_dir()) in _network_filesystems
+    return _state_on_network_fs
+
+
+def _use_flat_file():
+    """
+    Whether to keep the pool history in a flat file instead of SQLite; set
+    $OSPOOL_STATE_BACKEND to "file" or "sqlite" to override the detection.
+    """
+    backend = os.environ.get("OSPOOL_STATE_BACKEND", "").lower()
+    if backend in ("file", "sqlite"):
+        return backend == "file"
+    return _is_network_filesystem()
+
+
+def get_state_db():
+    """
+    Return the process-wide connection to the state database, opening it on first use.
+    WAL mode is enabled unless the state directory is on a network filesystem.
+    """
+    global _state_db
+    with _state_lock:
+        if _state_db is not None:
+            return _state_db
+
+        conn = sqlite3.connect(str(_get_state_dir() / "state.db"), timeout=30, check_same_thread=False)
+        if not _is_network_filesystem():
+            conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS pool_history (name text)")
+            columns = set(row[1] for row in conn.execute("PRAGMA table_info(pool_history)"))
+            if 'uses' not in columns:
+                conn.execute("ALTER TABLE pool_history ADD COLUMN uses INTEGER NOT NULL DEFAULT 0")
+            if 'last_used' not in columns:
+                conn.execute("ALTER TABLE pool_history ADD COLUMN last_used REAL")
+        _state_db = conn
+        return conn
+
+
+def _get_pool_file():
+    return _get_state_dir() / "pools.json"
+
+
+def _usage_from_rows(rows):
+    usage = {}
+    for name, uses, last_used in rows:
+        previous = usage.get(name, [0, None])
+        usage[name] = [previous[0] + (uses or 0), max(last_used or 0, previous[1] or 0) or None]
+    return usage
+
+
+def _read_state_db_pool_usage():
+    # Read-only, so a state directory on a network filesystem is never locked for writing.
+    path = _get_state_dir() / "state.db"
+    if not path.exists():
+        return {}
+    try:
+        conn = sqlite3.connect("file:{}?mode=ro".format(path), uri=True)
+        try:
+            columns = set(row[1] for row in conn.execute("PRAGMA table_info(pool_history)"))
+            return _usage_from_rows(conn.execute("SELECT name, {}, {} FROM pool_history".format(
+                'uses' if 'uses' in columns else '0', 'last_used' if 'last_used' in columns else 'NULL')))
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return {}
+
+
+def _read_pool_usage():
+    if _use_flat_file():
+        try:
+            with open(str(_get_pool_file())) as fp:
+                return {name: list(usage) for name, usage in json.load(fp).items()}
+        except FileNotFoundError:
+            # Start from the history kept in SQLite before the flat file was used.
+            return _read_state_db_pool_usage()
+        except (OSError, ValueError, AttributeError, TypeError):
+            return {}
+
+    return _usage_from_rows(get_state_db().execute("SELECT name, uses, last_used FROM pool_history"))
+
+
+def _record_pool_usage(pools, now):
+    """
+    Add one use of each of `pools` at time `now` to the state store and return the
+    updated usage of every pool.
+    """
+    if _use_flat_file():
+        # A lost update from a concurrent process only costs a usage count; an atomic
+        # rename means readers never see a partially-written file.
+        usage = _read_pool_usage()
+        for pool in pools:
+            usage[pool] = [usage.get(pool, [0, None])[0] + 1, now]
+        path = _get_pool_file()
+        fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=".pools-")
+        try:
+            with os.fdopen(fd, "w") as fp:
+                json.dump(usage, fp)
+            os.replace(tmp_path, str(path))
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+        return usage
+
+    # Incremented in place in one transaction, so concurrent processes never lose a use.
+    conn = get_state_db()
+    with conn:
+        for pool in pools:
+            if not conn.execute("UPDATE pool_history SET uses = uses + 1, last_used = ? WHERE rowid = "
+                    "(SELECT MIN(rowid) FROM pool_history WHERE name = ?)", (now, pool)).rowcount:
+                conn.execute("INSERT INTO pool_history (name, uses, last_used) VALUES (?, 1, ?)", (pool, now))
+    return _read_pool_usage()
+
+
+def _get_pool_usage():
+    global _pool_usage
+    with _state_lock:
+        if _pool_usage is None:
+            try:
+                _pool_usage = _read_pool_usage()
+            except (OSError, sqlite3.Error):
+                _pool_usage = {}
+        return _pool_usage
 
 
 def get_pool_history():
     """
     Return a set of all pools used in the recorded history
     """
-    try:
-        conn = _get_state_db(read_only=True)
-        with conn:
-            return set(row[0] for row in conn.execute("SELECT name FROM pool_history"))
-    except:
-        return set()
-    return all_pools
+    return set(_get_pool_usage())
+
+
+def get_pools_by_usage():
+    """
+    Return the pools in the recorded history, most frequently used first
+    """
+    usage = _get_pool_usage()
+    return sorted(usage, key=lambda name: (-usage[name][0], -(usage[name][1] or 0), name))
 
 
 def add_pool_history(pool):
     """
-    Record a pool has been seen in the 
+    Record a pool has been used.
+
+    The write is deferred until `flush_pool_history` is called, at the latest when the
+    process exits, so it never delays the command's output.
     """
-    # Opening a SQLite3 DB read-write requires a lock; these can be heavy for shared FS.
-    # Since we will write to the DB only the first time the pool is used (and there aren't
-    # that many pools around!), optimistically assume we can get away with read-only.
-    if pool in get_pool_history():
-        return
+    global _flush_registered
+    with _state_lock:
+        if not _flush_registered:
+            atexit.register(flush_pool_history)
+            _flush_registered = True
+        if pool not in _pending_pools:
+            _pending_pools.append(pool)
 
-    with _get_state_db() as conn:
-        conn.execute("INSERT INTO pool_history VALUES (?)", (pool, ));
+
+def flush_pool_history():
+    """
+    Write the usage of pools recorded by `add_pool_history` to the state store; returns
+    True if anything was written.
+    """
+    with _state_lock:
+        if not _pending_pools:
+            return False
+        pending = list(_pending_pools)
+        del _pending_pools[:]
+        try:
+            global _pool_usage
+            _pool_usage = _record_pool_usage(pending, time.time())
+        except (OSError, sqlite3.Error):
+            return False
+        return True
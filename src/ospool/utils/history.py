@@ -0,0 +1,166 @@
+"""Time series of entry counters, recorded in the state database"""
+
+import fnmatch
+import operator
+import re
+import time
+
+import ospool.model as model
+import ospool.utils.config as config
+
+
+# Counters recorded for each (pool, entry, group): (ClassAd attribute, column in
+# entry_samples).  Each column is named after its `model.GroupPressure` attribute.
+history_counters = model.counters
+
+history_columns = [column for _, column in history_counters]
+
+history_projection = ['GlideFactoryName', 'GlideGroupName'] + [attr for attr, _ in history_counters]
+
+# Samples older than this many seconds are deleted.
+DEFAULT_RETENTION = 30 * 86400
+
+# Samples older than this many seconds are averaged into one sample per bucket.
+DEFAULT_DOWNSAMPLE_AFTER = 2 * 86400
+DOWNSAMPLE_BUCKET = 3600
+
+_duration_units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+
+def parse_duration(value):
+    """
+    Convert a duration such as "90m", "24h", or "30d" into seconds; a bare number is
+    taken as seconds.  Raises ValueError for anything else.
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*([smhdw]?)\s*", value.lower())
+    if not match:
+        raise ValueError("Invalid duration {!r}; expected a number followed by s, m, h, d, or w".format(value))
+    return int(match.group(1)) * _duration_units[match.group(2) or 's']
+
+
+def _get_history_db():
+    conn = config.get_state_db()
+    with conn:
+        # Series names are stored once; samples are keyed by (series, timestamp) with no
+        # separate rowid, so each sample costs little more than its counters.
+        conn.execute("""CREATE TABLE IF NOT EXISTS entry_series (
+            id INTEGER PRIMARY KEY,
+            pool TEXT NOT NULL,
+            entry TEXT NOT NULL,
+            factory TEXT NOT NULL DEFAULT '',
+            grp TEXT NOT NULL,
+            UNIQUE (pool, entry, factory, grp))""")
+        if 'factory' not in set(row[1] for row in conn.execute("PRAGMA table_info(entry_series)")):
+            # Series recorded before the factory was part of the key keep their ids (and
+            # so their samples), with an empty factory.
+            conn.execute("""CREATE TABLE entry_series_new (
+                id INTEGER PRIMARY KEY,
+                pool TEXT NOT NULL,
+                entry TEXT NOT NULL,
+                factory TEXT NOT NULL DEFAULT '',
+                grp TEXT NOT NULL,
+                UNIQUE (pool, entry, factory, grp))""")
+            conn.execute("INSERT INTO entry_series_new (id, pool, entry, grp) SELECT id, pool, entry, grp FROM entry_series")
+            conn.execute("DROP TABLE entry_series")
+            conn.execute("ALTER TABLE entry_series_new RENAME TO entry_series")
+        conn.execute("""CREATE TABLE IF NOT EXISTS entry_samples (
+            series INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            samples INTEGER NOT NULL DEFAULT 1,
+            {},
+            PRIMARY KEY (series, ts)) WITHOUT ROWID""".format(
+                ",\n            ".join("{} INTEGER".format(column) for column in history_columns)))
+        conn.execute("CREATE INDEX IF NOT EXISTS entry_samples_ts ON entry_samples (ts)")
+    return conn
+
+
+def record_snapshot(entries, timestamp=None):
+    """
+    Record the counters of each group of the `model.Entry` objects in `entries` in a
+    single transaction.  Returns the number of samples written.
+    """
+    timestamp = int(timestamp if timestamp is not None else time.time())
+
+    conn = _get_history_db()
+    with conn:
+        series_ids = {(pool, entry, factory, grp): series_id for series_id, pool, entry, factory, grp in
+            conn.execute("SELECT id, pool, entry, factory, grp FROM entry_series")}
+
+        get_counters = operator.attrgetter(*history_columns)
+        rows = []
+        for entry in entries:
+            for group in entry.groups:
+                key = (entry.pool or "", entry.name, entry.factory or "", group.name or "")
+                series_id = series_ids.get(key)
+                if series_id is None:
+                    series_id = conn.execute("INSERT INTO entry_series (pool, entry, factory, grp) VALUES (?, ?, ?, ?)", key).lastrowid
+                    series_ids[key] = series_id
+                rows.append((series_id, timestamp) + get_counters(group))
+
+        conn.executemany("INSERT OR REPLACE INTO entry_samples (series, ts, {}) VALUES (?, ?, {})".format(
+            ", ".join(history_columns), ", ".join("?" * len(history_columns))), rows)
+    return len(rows)
+
+
+def prune_history(retention=DEFAULT_RETENTION, downsample_after=DEFAULT_DOWNSAMPLE_AFTER, now=None):
+    """
+    Delete samples older than `retention` seconds and average samples older than
+    `downsample_after` seconds into one sample per hour for each series.
+    """
+    now = int(now if now is not None else time.time())
+
+    # Weighted by the number of raw samples each row already represents; NULL counters
+    # (attribute missing from the ad) do not count towards the average.
+    averages = ", ".join(
+        "CAST(ROUND(SUM({0} * samples) * 1.0 / NULLIF(SUM(CASE WHEN {0} IS NULL THEN 0 ELSE samples END), 0)) AS INTEGER) AS {0}".format(column)
+        for column in history_columns)
+
+    conn = _get_history_db()
+    with conn:
+        conn.execute("DELETE FROM entry_samples WHERE ts < ?", (now - retention, ))
+        conn.execute("DELETE FROM entry_series WHERE id NOT IN (SELECT DISTINCT series FROM entry_samples)")
+
+        conn.execute("DROP TABLE IF EXISTS temp.downsampled")
+        conn.execute("""CREATE TEMP TABLE downsampled AS
+            SELECT series, (ts / :bucket) * :bucket AS ts, SUM(samples) AS samples, {}
+            FROM entry_samples WHERE ts < :cutoff
+            GROUP BY series, ts / :bucket
+            HAVING COUNT(*) > 1 OR MIN(ts % :bucket) > 0""".format(averages),
+            {"bucket": DOWNSAMPLE_BUCKET, "cutoff": now - downsample_after})
+        conn.execute("""DELETE FROM entry_samples WHERE ts < :cutoff AND EXISTS (
+            SELECT 1 FROM temp.downsampled AS d WHERE d.series = entry_samples.series
+                AND d.ts = (entry_samples.ts / :bucket) * :bucket)""",
+            {"bucket": DOWNSAMPLE_BUCKET, "cutoff": now - downsample_after})
+        conn.execute("INSERT INTO entry_samples (series, ts, samples, {0}) SELECT series, ts, samples, {0} FROM temp.downsampled".format(
+            ", ".join(history_columns)))
+        conn.execute("DROP TABLE temp.downsampled")
+
+
+def get_entry_history(entry, since, pool=None, group=None, factory=None):
+    """
+    Return the samples for entries matching the glob `entry` recorded in the last
+    `since` seconds, as a list of dictionaries sorted by entry, pool, factory, group,
+    and time.  Series recorded before the factory was tracked have a `Factory` of None.
+    """
+    conn = _get_history_db()
+    matches = [row for row in conn.execute("SELECT id, pool, entry, factory, grp FROM entry_series")
+        if fnmatch.fnmatch(row[2].lower(), entry.lower())
+            and (pool is None or row[1] == pool)
+            and (factory is None or row[3].lower() == factory.lower())
+            and (group is None or fnmatch.fnmatch(row[4].lower(), group.lower()))]
+    series_info = {row[0]: row[1:] for row in matches}
+
+    results = []
+    if series_info:
+        cutoff = int(time.time()) - since
+        for series_id in series_info:
+            for row in conn.execute("SELECT ts, samples, {} FROM entry_samples WHERE series = ? AND ts >= ? ORDER BY ts".format(
+                    ", ".join(history_columns)), (series_id, cutoff)):
+                series_pool, series_entry, series_factory, series_group = series_info[series_id]
+                sample = {'Pool': series_pool, 'EntryName': series_entry, 'Factory': series_factory or None,
+                    'GlideGroupName': series_group, 'Timestamp': row[0], 'Samples': row[1]}
+                sample.update(zip(history_columns, row[2:]))
+                results.append(sample)
+    results.sort(key=lambda sample: (sample['EntryName'], sample['Pool'], sample['Factory'] or "", sample['GlideGroupName'],
+        sample['Timestamp']))
+    return results
@@ -0,0 +1,78 @@
+"""Export stage timings and entry counters as an OpenMetrics textfile"""
+
+import os
+import tempfile
+
+import ospool.model as model
+import ospool.utils.history as history
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels):
+    return "{" + ",".join('{}="{}"'.format(key, _escape(value)) for key, value in labels.items()) + "}"
+
+
+def format_metrics(timings, command=None):
+    """
+    Return the OpenMetrics exposition of the stages and entries recorded in `timings`.
+    """
+    lines = []
+
+    def family(name, help_text, samples):
+        lines.append("# TYPE {} gauge".format(name))
+        lines.append("# HELP {} {}".format(name, help_text))
+        lines.extend("{}{} {}".format(name, labels, value) for labels, value in samples)
+
+    command_labels = {"command": command} if command else {}
+    family("ospool_stage_duration_seconds", "Time spent in each stage of the last ospool run.",
+        [(_labels(stage=name, **command_labels), repr(seconds)) for name, (seconds, _, _) in timings.stages.items()])
+    family("ospool_stage_ads", "Number of ads handled by each stage of the last ospool run.",
+        [(_labels(stage=name, **command_labels), ads) for name, (_, ads, _) in timings.stages.items() if ads is not None])
+    family("ospool_stage_bytes", "Approximate bytes handled by each stage of the last ospool run.",
+        [(_labels(stage=name, **command_labels), nbytes) for name, (_, _, nbytes) in timings.stages.items() if nbytes is not None])
+    family("ospool_run_duration_seconds", "Wall clock duration of the last ospool run.",
+        [(_labels(**command_labels) if command_labels else "", repr(timings.elapsed()))])
+
+    samples = {column: [] for column in history.history_columns}
+    seen = set()
+    for pool, ads in timings.entries.items():
+        for entry in model.entries_from_ads(ads):
+            for group in entry.groups:
+                key = (pool, entry.name, entry.factory or "", group.name or "")
+                if key in seen:
+                    continue
+                seen.add(key)
+                labels = _labels(pool=key[0], entry=key[1], factory=key[2], group=key[3])
+                for column in history.history_columns:
+                    value = getattr(group, column)
+                    if value is not None:
+                        samples[column].append((labels, value))
+    for attr, column in history.history_counters:
+        if samples[column]:
+            family("ospool_entry_" + column, "Value of {} for the entry, factory, and group.".format(attr), samples[column])
+
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file(path, timings, command=None):
+    """
+    Atomically replace `path` with the metrics, as expected by the node_exporter
+    textfile collector.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".ospool-metrics-")
+    try:
+        with os.fdopen(fd, "w") as fp:
+            fp.write(format_metrics(timings, command))
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
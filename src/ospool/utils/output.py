@@ -0,0 +1,74 @@
+"""Machine-readable writers for query results"""
+
+import csv
+import json
+
+import ospool.model as model
+import ospool.utils.cache as cache
+import ospool.utils.projection as projection
+import ospool.utils.query as query
+
+
+output_formats = ["json", "jsonl", "csv"]
+
+# Fields computed from the ad rather than copied from one of its attributes.
+derived_fields = list(projection.derived_field_attrs)
+
+# Schema of the records written by `ospool show`.
+show_fields = derived_fields + [attr for attr in query.entry_info_projection if attr not in derived_fields]
+
+# Schema of the records written by `ospool list-entries`.
+list_fields = derived_fields + ['GLIDEIN_ResourceName', 'GLIDEIN_Resource_Slots']
+
+
+def entry_record(entry, fields):
+    """
+    Convert a glideresource ad into a dictionary with exactly the keys in `fields`;
+    attributes missing from the ad are set to None.
+    """
+    entry_name, factory = model.split_factory_name(entry.get('GlideFactoryName') or "")
+    derived = {
+        'Pool': entry.get(query.source_pool_attr),
+        'EntryName': entry_name or None,
+        'Factory': factory,
+        'CEHostname': model.ce_hostname(entry.get('GLIDEIN_Gatekeeper')),
+    }
+    record = {}
+    for field in fields:
+        if field in derived:
+            record[field] = derived[field]
+        else:
+            record[field] = cache.to_json_value(entry.get(field))
+    return record
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, separators=(",", ":"))
+    return value
+
+
+def write_records(records, output_format, fields, stream):
+    """
+    Write each record to `stream` as soon as it is produced by the `records` iterable,
+    so memory use does not grow with the number of records.
+    """
+    if output_format == "jsonl":
+        for record in records:
+            stream.write(json.dumps(record) + "\n")
+    elif output_format == "json":
+        stream.write("[")
+        separator = "\n"
+        for record in records:
+            stream.write(separator + json.dumps(record))
+            separator = ",\n"
+        stream.write("\n]\n")
+    elif output_format == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(fields)
+        for record in records:
+            writer.writerow([_csv_value(record[field]) for field in fields])
+    else:
+        raise ValueError("Unknown output format {}".format(output_format))
@@ -0,0 +1,34 @@
+"""Plan the smallest set of ClassAd attributes a command needs from the collector"""
+
+
+# Attributes each derived output field is computed from; `Pool` is added by `query_pools`.
+derived_field_attrs = {
+    'Pool':       [],
+    'EntryName':  ['GlideFactoryName'],
+    'Factory':    ['GlideFactoryName'],
+    'CEHostname': ['GLIDEIN_Gatekeeper'],
+}
+
+# Attributes used by shell completion of entry names, resources, and CE hostnames; the
+# same list is used for all three so they share one cached snapshot.
+completion_projection = ['GlideFactoryName', 'GLIDEIN_ResourceName', 'GLIDEIN_Gatekeeper']
+
+
+def field_attrs(field):
+    """
+    Return the ClassAd attributes needed to compute the output field `field`; any name
+    that is not a derived field is taken to be an attribute.
+    """
+    return derived_field_attrs.get(field, [field])
+
+
+def plan(fields=(), attrs=()):
+    """
+    Return the attributes needed for each of `fields` followed by the raw `attrs`, in
+    order and without duplicates.
+    """
+    needed = []
+    for field in fields:
+        needed.extend(field_attrs(field))
+    needed.extend(attrs)
+    return list(dict.fromkeys(needed))
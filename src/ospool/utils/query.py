@@ -1,13 +1,19 @@
 """Common queries against the OSPool."""
 
-import fnmatch
+import queue
+import re
+import threading
+import time
 
-import htcondor
+import classad
 
+import ospool.utils.backend as backend
+import ospool.utils.cache as cache
 import ospool.utils.config as config
+import ospool.utils.timing as timing
 
 
-# All the projection attributes needed to print out an entry's info.
+# Attributes describing an entry, written by default by `ospool show --output json/jsonl/csv`.
 entry_info_projection = [
     'GlideGroupName',                          # Group name within the frontend
     'GlideFactoryName',                        # The tuple of (entry name, 'gfactory_instance' (not clear if this is static or not), factory)
@@ -23,7 +29,7 @@ entry_info_projection = [
     'GlideFactoryMonitorStatusRunning',        # Number of glideins created by the factory reported running by CE.
     'GlideFactoryMonitorStatusPending',        # Number of idle glideins created by the factory and idle in the CE's queue.
     'GlideFactoryMonitorStatusHeld',           # Number of glideins created by the factory and held at the factory.
-    'GLIDEIN_In_Downtime'                      # Whether or not the entry is in downtime.
+    'GLIDEIN_In_Downtime',                     # Whether or not the entry is in downtime.
     'GlideClientLimitTotalGlideinsPerEntry',   # Set when a limit is hit due to total glideins per entry.
     'GlideClientLimitIdleGlideinsPerEntry',    # Set when a limit is hit due to idle glideins.
     'GlideClientLimitTotalGlideinsPerGroup',   # Set when a limit is hit due to total glideins in the group
@@ -44,67 +50,227 @@ entry_info_projection = [
 ]
 
 
+# Attribute added to each ad returned by `query_pools` recording the pool it came from.
+source_pool_attr = 'SourcePool'
+
+# Base constraint selecting the frontend's view of each factory entry.
+glideresource_constraint = 'MyType =?= "glideresource"'
+
+
+def glob_to_regex(pattern, wildcard=".*"):
+    """
+    Translate a Unix glob into an (unanchored) PCRE pattern suitable for the ClassAd
+    `regexp()` function.  `wildcard` is the expansion used for `*`.
+    """
+    result = []
+    idx, length = 0, len(pattern)
+    while idx < length:
+        char = pattern[idx]
+        idx += 1
+        if char == '*':
+            result.append(wildcard)
+        elif char == '?':
+            result.append(wildcard[:-1] if wildcard.endswith('*') else '.')
+        elif char == '[':
+            end = idx
+            if end < length and pattern[end] == '!':
+                end += 1
+            if end < length and pattern[end] == ']':
+                end += 1
+            while end < length and pattern[end] != ']':
+                end += 1
+            if end >= length:
+                result.append('\\[')
+                continue
+            contents = pattern[idx:end].replace('\\', '\\\\').replace('[', '\\[')
+            idx = end + 1
+            if contents.startswith('!'):
+                contents = '^' + contents[1:]
+            elif contents.startswith('^'):
+                contents = '\\' + contents
+            result.append('[' + contents + ']')
+        else:
+            result.append(re.escape(char))
+    return ''.join(result)
+
+
+def _regex_predicate(pattern, case_insensitive):
+    regex = re.compile(pattern, re.IGNORECASE if case_insensitive else 0)
+    # Anchored patterns only need to be tried at the start of the string.
+    test = regex.match if pattern.startswith("^") else regex.search
+    return lambda value: isinstance(value, str) and test(value) is not None
+
+
 class EntryFilter(object):
+    """
+    Select glideresource ads by entry name, factory, resource, CE hostname, or GPU support.
+    `factory` may be a single factory name or a list of them.
+
+    The globs are compiled once into regular expressions; the same expressions are used
+    for the collector constraint and for filtering the ads client-side.
+    """
 
     def __init__(self, resource=None, gpus_only=False, ce_hostname=None, entry=None, factory=None):
         self.resource = resource.lower() if resource else None
         self.gpus_only = gpus_only
         self.ce_hostname = ce_hostname.lower() if ce_hostname else None
         self.entry = entry.lower() if entry else None
-        self.factory = factory.lower() if entry else None
+        if isinstance(factory, str):
+            factory = [factory]
+        self.factories = tuple(sorted(set(name.lower() for name in factory))) if factory else ()
 
-    def __call__(self, entry):
+        # List of (attribute, regex, case-insensitive) tuples; all must match.  Ordered
+        # so the cheapest and most selective filters run first.
+        self._matches = []
         if self.gpus_only:
-            if 'GLIDEIN_Resource_Slots' not in entry:
-                return False
-            has_gpu = False
-            for resource_command in entry['GLIDEIN_Resource_Slots'].split(";"):
-                if resource_command.split(",")[0] == 'GPUs':
-                    has_gpu = True
-                    break
-            if not has_gpu:
+            self._matches.append(('GLIDEIN_Resource_Slots', "(^|;)GPUs(,|;|$)", False))
+        if self.entry is not None:
+            self._matches.append(('GlideFactoryName', "^" + glob_to_regex(self.entry, "[^@]*") + "(@|$)", True))
+        if self.resource is not None:
+            self._matches.append(('GLIDEIN_ResourceName', "^" + glob_to_regex(self.resource) + "$", True))
+        if self.ce_hostname is not None:
+            self._matches.append(('GLIDEIN_Gatekeeper', "^" + glob_to_regex(self.ce_hostname, "[^ ]*") + "( |$)", True))
+        if self.factories:
+            self._matches.append(('GlideFactoryName',
+                "(^|@)(" + "|".join(re.escape(name) for name in self.factories) + ")$", True))
+
+        self._predicates = [(attr, _regex_predicate(pattern, nocase)) for attr, pattern, nocase in self._matches]
+        if self.factories:
+            # A suffix comparison is much cheaper than a regex search that scans the whole name.
+            factories = frozenset(self.factories)
+            self._predicates[-1] = ('GlideFactoryName',
+                lambda value: isinstance(value, str) and value.rpartition("@")[2].lower() in factories)
+
+    def __call__(self, entry):
+        for attr, predicate in self._predicates:
+            if not predicate(entry.get(attr)):
                 return False
+        return True
 
-        factory = entry['GlideFactoryName'].rsplit("@", 1)[-1].lower()
-        if self.factory is not None and factory != self.factory:
-            return False
+    def filter_many(self, entries):
+        """
+        Return the list of ads from `entries` accepted by the filter.
 
-        entry_name = entry['GlideFactoryName'].split("@", 1)[0].lower()
-        if self.entry is not None and not fnmatch.fnmatch(entry_name, self.entry):
-            return False
+        Rather than running every check per ad, each check makes one pass over the ads
+        that survived the previous checks, so rejected ads are only examined once.
+        """
+        entries = entries if isinstance(entries, list) else list(entries)
+        for attr, predicate in self._predicates:
+            if not entries:
+                break
+            entries = [entry for entry in entries if predicate(entry.get(attr))]
+        return entries
 
-        if self.resource is not None:
-            if 'GLIDEIN_ResourceName' not in entry or not fnmatch.fnmatch(entry['GLIDEIN_ResourceName'].lower(), self.resource):
-                return False
+    def get_constraint(self):
+        """
+        Return a ClassAd constraint selecting the glideresource ads this filter accepts.
 
-        if self.ce_hostname is not None:
-            if 'GLIDEIN_Gatekeeper' not in entry:
-                return False
-            ce_hostname = entry['GLIDEIN_Gatekeeper'].split(' ', 1)[0].lower()
-            if not fnmatch.fnmatch(ce_hostname, self.ce_hostname):
-                return False
+        The constraint never rejects an ad the filter would accept, so the collector can
+        drop most ads before they are sent; `__call__` still runs on the results.
+        """
+        clauses = [glideresource_constraint]
+        for attr, pattern, nocase in self._matches:
+            clauses.append('regexp({}, {}{})'.format(classad.quote(pattern), attr, ', "i"' if nocase else ''))
 
-        return True
+        return " && ".join(clauses)
 
     def get_projection_attrs(self):
-        return set([
-            'GlideFactoryName',       # The name of this entry according to the factory
-            'GLIDEIN_Resource_Slots', # The layout of any special resource (including GPUs)
-            'GLIDEIN_Gatekeeper',     # The 'grid_resource' line to use for pilot submission.
-            'GLIDEIN_ResourceName',   # The OSG topology resource name.
-        ])
+        """
+        Return the attributes read when filtering client-side; only the attributes of
+        the checks in use are needed.
+        """
+        return set(attr for attr, _ in self._predicates)
+
+
+def _query_collector(pool, constraint, projection):
+    with timing.stage("collector query") as details:
+        entries = backend.get_collector(pool).query('any', constraint, projection)
+        details.ads = len(entries)
+    if timing.timings.enabled:
+        timing.timings.add("collector query", 0, nbytes=timing.approximate_size(entries))
+    return entries
+
+
+def _query_server(pool, constraint, projection, max_age):
+    # Only reported when a server answered, since most runs have none to ask.
+    start = time.perf_counter()
+    entries = backend.query_server(pool, constraint, projection, max_age)
+    if entries is not None:
+        timing.timings.add("server query", time.perf_counter() - start, len(entries))
+    return entries
+
 
+def query_entries(pool, filter_obj, projection, use_cache=True, max_age=None, record_usage=True):
+    """
+    Yield the glideresource ads in `pool` accepted by `filter_obj`.  Unless
+    `record_usage` is False (as for shell completion), the use of the pool is recorded
+    in the pool history.
 
-def query_entries(pool, filter_obj, projection):
+    Unless `use_cache` is False, results come from a running `ospool serve` tracking the
+    pool or else the on-disk snapshot cache, when their snapshot is younger than
+    `max_age` seconds (by default, the server's refresh interval or
+    `cache.get_max_age()` respectively).
+    """
 
-    config.add_pool_history(pool)
+    if record_usage:
+        config.add_pool_history(pool)
 
-    collector = htcondor.Collector(pool)
-    projection_attrs = set(projection).union(filter_obj.get_projection_attrs())
-    entries = collector.query(ad_type=htcondor.AdTypes.Any,
-                    constraint='MyType =?= "glideresource"',
-                    projection=list(projection_attrs))
+    projection_attrs = sorted(set(projection).union(filter_obj.get_projection_attrs()))
+    constraint = filter_obj.get_constraint()
+    entries = _query_server(pool, constraint, projection_attrs, max_age) if use_cache else None
+    if entries is None:
+        if use_cache:
+            entries = cache.cached_query(pool, projection_attrs, constraint, _query_collector, max_age=max_age)
+        else:
+            entries = _query_collector(pool, constraint, projection_attrs)
+
+    with timing.stage("filter") as details:
+        entries = filter_obj.filter_many(entries)
+        details.ads = len(entries)
+    timing.timings.add_entries(pool, entries)
 
     for entry in entries:
-        if filter_obj(entry):
+        yield entry
+
+
+def query_pools(pools, filter_obj, projection, timeout=None, on_error=None, **kwargs):
+    """
+    Query several pools concurrently, yielding the accepted ads from each pool as soon
+    as its query completes.  Each ad is tagged with its pool in `source_pool_attr`.
+
+    A pool that fails, or does not respond within `timeout` seconds, does not affect the
+    others; `on_error(pool, exception)` is invoked for it instead.  Remaining keyword
+    arguments are passed to `query_entries`.
+    """
+    pools = list(dict.fromkeys(pools))
+    results = queue.Queue()
+
+    def worker(pool):
+        try:
+            results.put((pool, list(query_entries(pool, filter_obj, projection, **kwargs)), None))
+        except Exception as exc:
+            results.put((pool, None, exc))
+
+    # Daemon threads, rather than an executor, so a hung collector cannot delay exit.
+    for pool in pools:
+        threading.Thread(target=worker, args=(pool,), name="query-" + pool, daemon=True).start()
+
+    deadline = time.monotonic() + timeout if timeout else None
+    pending = set(pools)
+    while pending:
+        try:
+            pool, entries, exc = results.get(timeout=max(deadline - time.monotonic(), 0) if deadline else None)
+        except queue.Empty:
+            break
+        pending.discard(pool)
+        if exc is not None:
+            if on_error is not None:
+                on_error(pool, exc)
+            continue
+        for entry in entries:
+            entry[source_pool_attr] = pool
             yield entry
+
+    for pool in pools:
+        if pool in pending and on_error is not None:
+            on_error(pool, TimeoutError("no response after {} seconds".format(timeout)))
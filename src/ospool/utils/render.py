@@ -0,0 +1,202 @@
+"""Render entries for the terminal, building the whole output in one buffer"""
+
+import shutil
+
+import click
+
+import ospool.model as model
+import ospool.utils.projection as projection
+
+
+# Description and table flag of each limit, reported in the order of
+# `model.entry_limit_attrs` and `model.group_limit_attrs`.
+limit_warnings = {
+    'GlideClientLimitTotalGlideinsPerEntry':    ("per-entry limit on total glideins", 'E'),
+    'GlideClientLimitIdleGlideinsPerEntry':     ("per-entry limit on idle glideins", 'E'),
+    'GlideClientLimitTotalGlideinsPerFrontend': ("frontend limit on total glideins", 'F'),
+    'GlideClientLimitIdleGlideinsPerFrontend':  ("frontend limit on idle glideins", 'F'),
+    'GlideClientLimitTotalGlideinsGlobal':      ("pool-wide limit on total glideins", 'P'),
+    'GlideClientLimitIdleGlideinsGlobal':       ("pool-wide limit on idle glideins", 'P'),
+    'GlideFactoryMonitorStatus_GlideFactoryLimitTotalGlideinsPerEntry': ("factory limit on total entry glideins", 'X'),
+    'GlideFactoryMonitorStatus_GlideFactoryLimitIdleGlideinsPerEntry':  ("factory limit on entry idle glideins", 'X'),
+    'GlideFactoryMonitorStatus_GlideFactoryLimitHeldGlideinsPerEntry':  ("factory limit on entry held glideins", 'X'),
+    'GlideClientLimitTotalGlideinsPerGroup':    ("group limit on total glideins", 'G'),
+    'GlideClientLimitIdleGlideinsPerGroup':     ("group limit on idle glideins", 'G'),
+}
+
+# Default columns of `--output table`: (output field, header).
+table_columns = [
+    ('EntryName',                               'ENTRY'),
+    ('GlideGroupName',                          'GROUP'),
+    ('GlideClientMonitorJobsIdle',              'IDLE'),
+    ('GlideClientMonitorJobsRunningHere',       'RUN'),
+    ('GlideClientMonitorGlideinsRequestIdle',   'REQ'),
+    ('GlideClientMonitorGlideinsRequestMaxRun', 'MAX'),
+    ('GlideFactoryMonitorStatusIdle',           'F.IDLE'),
+    ('GlideFactoryMonitorStatusPending',        'CE.IDLE'),
+    ('GlideFactoryMonitorStatusRunning',        'CE.RUN'),
+    ('GlideFactoryMonitorStatusHeld',           'HELD'),
+    ('GlideClientMonitorGlideinsRunning',       'SLOTS'),
+    ('GlideClientMonitorGlideinsIdle',          'S.IDLE'),
+]
+table_fields = [field for field, _ in table_columns]
+table_headers = dict(table_columns, Pool='POOL', Factory='FACTORY', CEHostname='CE')
+
+# Attributes read by the table flags.
+flag_attrs = ['GLIDEIN_In_Downtime', 'GlideFactoryMonitorRequestedIdle', 'GlideFactoryMonitorRequestedMaxGlideins',
+    'GlideClientMonitorGlideinsRequestIdle', 'GlideClientMonitorGlideinsRequestMaxRun'] + \
+    model.entry_limit_attrs + model.group_limit_attrs
+
+# Every attribute read by `format_entry`.
+entry_attrs = model.projection
+
+table_flags_legend = ("Flags: D = in downtime, E = per-entry limit, F = frontend limit, P = pool-wide limit, "
+    "G = group limit, X = factory limit, R = factory changed the request")
+
+
+def table_attrs(fields):
+    """
+    Return the attributes needed to print a table with the columns `fields`.
+    """
+    return projection.plan(fields, ['GlideFactoryName'] + flag_attrs)
+
+
+_warning = click.style("WARNING:", fg='red', bold=True)
+
+
+def format_entry(entry, show_pool=False, show_factory=False):
+    """
+    Return the human-readable description of a `model.Entry` and each of its groups.
+    """
+    out = []
+    write = out.append
+
+    site_info = []
+    if show_pool and entry.pool:
+        site_info.append(f"Pool {entry.pool}")
+    if show_factory and entry.factory:
+        site_info.append(f"Factory {entry.factory}")
+    if entry.resource is not None:
+        site_info.append(f"Resource name {entry.resource}")
+    if entry.ce_host is not None:
+        site_info.append(f"CE hostname {entry.ce_host}")
+    site_info = " (" + ", ".join(site_info) + ")" if site_info else ""
+    write("\nData for entry " + click.style(f"{entry.name}", bold=True) + site_info)
+    for attr, value in entry.limits:
+        write(f"{_warning} Requests will be reduced due to {limit_warnings[attr][0]}: {value}")
+
+    if entry.whole_node:
+        write("- Whole node entry " + (f"with an estimated {entry.estimated_cpus} cores per glidein" if entry.estimated_cpus is not None else ''))
+    elif entry.cpus == 1:
+        write("- Entry has 1 core per glidein")
+    elif entry.cpus is not None:
+        write(f"- Entry has {entry.cpus} cores per glidein")
+
+    for gpus in entry.gpus:
+        if gpus == 1:
+            write("- Entry has 1 GPU per glidein")
+        elif gpus is not None:
+            write(f"- Entry has {gpus} GPUs per glidein")
+        else:
+            write("- Entry has GPUs available to glidein")
+
+    write("")
+
+    if entry.in_downtime:
+        write(f"{_warning} Entry point is currently in downtime\n")
+
+    for group in entry.groups:
+        write("Data for OSPool group " + click.style(f"{group.name}", bold=True))
+
+        for attr, value in group.limits:
+            write(f"{_warning} Requests will be reduced due to {limit_warnings[attr][0]}: {value}")
+
+        write("- Matching payload jobs:")
+        write(f"  - Idle:                          {group.jobs_idle}")
+        write(f"  - Running at this entry:         {group.jobs_running}")
+        write("- Requests for glideins in the CE:")
+        write(f"  - Idle in CE queue:              {group.request_idle}")
+        if group.factory_request_idle is not None and group.request_idle != group.factory_request_idle:
+            write("    - " + click.style("WARNING", bold=True, fg='red') + f": Factory changed this to {group.factory_request_idle}")
+        write(f"  - Limit:                         {group.request_max_run}")
+        if group.factory_request_max is not None and group.request_max_run != group.factory_request_max:
+            write("    - " + click.style("WARNING", bold=True, fg='red') + f": Factory changed this to {group.factory_request_max}")
+        if group.status_idle is not None or group.status_pending is not None or group.status_running is not None:
+            write("- Created glideins for the CE:")
+            if group.status_pending is not None:
+                write(f"  - Created and idle in factory    {group.status_idle}")
+                write(f"  - Idle in the CE's queue         {group.status_pending}")
+            if group.status_held:
+                write("  - In an error state (\"held\")     " + click.style(f"{group.status_held}", fg='red', bold=True))
+            elif group.status_held is not None:
+                write(f"  - In an error state (\"held\")     {group.status_held}")
+            if group.status_running is not None:
+                write(f"  - Reported by CE as running      {group.status_running}")
+        write("- Running glideins for this group connected to OSPool collector:")
+        write(f"  - Slots in collector:            {group.glideins_running}")
+        write(f"  - Slots without payloads:        {group.glideins_idle}")
+        write("")
+
+    return "\n".join(out) + "\n"
+
+
+def _table_flags(entry, group):
+    flags = set(limit_warnings[attr][1] for attr, _ in entry.limits + group.limits)
+    if entry.in_downtime:
+        flags.add('D')
+    if group.factory_changed_request():
+        flags.add('R')
+    return "".join(sorted(flags))
+
+
+def _table_cell(value):
+    if value is None:
+        return "-"
+    return value if isinstance(value, str) else str(value)
+
+
+def format_table(entries, fields=None):
+    """
+    Return an aligned table of `model.Entry` objects with one row per entry and group
+    and a column for each of `fields` (output field names; by default `table_fields`).
+    Fields listed by `model.extra_fields` must have been requested as extra attributes.
+    """
+    fields = fields or table_fields
+    numeric = [True] * len(fields)
+    rows = []
+    for entry in entries:
+        for group in entry.groups:
+            row = []
+            for idx, field in enumerate(fields):
+                value = model.field_value(entry, group, field)
+                if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+                    numeric[idx] = False
+                row.append(_table_cell(value))
+            row.append(_table_flags(entry, group) or "-")
+            rows.append(row)
+
+    headers = [table_headers.get(field, field) for field in fields] + ["FLAGS"]
+    numeric.append(False)
+    widths = [max(len(row[idx]) for row in rows + [headers]) for idx in range(len(headers))]
+    lines = []
+    for row in [headers] + rows:
+        cells = [cell.rjust(width) if is_numeric else cell.ljust(width)
+            for cell, width, is_numeric in zip(row, widths, numeric)]
+        lines.append("  ".join(cells).rstrip())
+    lines.append("")
+    lines.append(table_flags_legend)
+    return "\n".join(lines) + "\n"
+
+
+def emit(text, pager=None):
+    """
+    Write `text` to stdout in a single call, through a pager if `pager` is True or if it
+    is None and the text does not fit on the terminal.
+    """
+    if pager is None:
+        stdout = click.get_text_stream('stdout')
+        pager = stdout.isatty() and text.count("\n") >= shutil.get_terminal_size().lines
+    if pager:
+        click.echo_via_pager(text)
+    else:
+        click.echo(text, nl=False)
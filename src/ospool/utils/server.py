@@ -0,0 +1,198 @@
+"""Answer queries from in-memory pool snapshots over a Unix socket, for `ospool serve`
+
+Each request is one line of JSON naming the pool, constraint, projection, and the
+oldest acceptable snapshot (see `backend.query_server`); the response is one line of
+JSON holding either the matching ads or an error.
+"""
+
+import collections
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+import classad
+
+import ospool.utils.backend as backend
+import ospool.utils.cache as cache
+import ospool.utils.query as query
+
+
+DEFAULT_INTERVAL = 60
+
+# Total bytes of encoded responses kept for each snapshot; the same few queries (the
+# defaults of each command, completion) make up most requests, while a query of the
+# whole pool can produce a response of several MB.
+MAX_CACHED_RESPONSE_BYTES = 64 * 1024 * 1024
+
+
+def _encode(response):
+    return json.dumps(response, separators=(",", ":")).encode() + b"\n"
+
+
+class Snapshot(object):
+    """
+    The glideresource ads of a pool as ClassAds, for evaluating constraints, and as
+    dictionaries, for the responses.
+    """
+
+    __slots__ = ['created', 'ads', 'records', 'names', 'responses', 'response_bytes', 'lock']
+
+    def __init__(self, ads, created=None):
+        self.created = created if created is not None else time.time()
+        self.ads = ads
+        self.records = [cache.to_json_value(ad) for ad in ads]
+        # Attribute names are case-insensitive, as in a ClassAd: each lowercase name maps
+        # to the spellings used by the ads.
+        self.names = {}
+        for record in self.records:
+            for name in record:
+                spellings = self.names.setdefault(name.lower(), [])
+                if name not in spellings:
+                    spellings.append(name)
+        # Cached responses, least recently used first.
+        self.responses = collections.OrderedDict()
+        self.response_bytes = 0
+        self.lock = threading.Lock()
+
+    def answer(self, constraint, projection):
+        key = (constraint, tuple(projection))
+        with self.lock:
+            response = self.responses.get(key)
+            if response is not None:
+                self.responses.move_to_end(key)
+                return response
+
+        expr = classad.ExprTree(constraint) if constraint else None
+        # Projected attributes are returned under the requested name, as the client will
+        # look them up with it.
+        columns = [(attr, self.names.get(attr.lower(), ())) for attr in projection]
+        ads = []
+        for ad, record in zip(self.ads, self.records):
+            if expr is not None and expr.eval(ad) is not True:
+                continue
+            if not projection:
+                ads.append(record)
+                continue
+            projected = {}
+            for attr, spellings in columns:
+                for name in spellings:
+                    if name in record:
+                        projected[attr] = record[name]
+                        break
+            ads.append(projected)
+
+        response = _encode({"created": self.created, "ads": ads})
+        if len(response) <= MAX_CACHED_RESPONSE_BYTES:
+            with self.lock:
+                if key not in self.responses:
+                    self.responses[key] = response
+                    self.response_bytes += len(response)
+                while self.response_bytes > MAX_CACHED_RESPONSE_BYTES:
+                    self.response_bytes -= len(self.responses.popitem(last=False)[1])
+        return response
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                request = None
+            self.wfile.write(self.server.answer(request))
+
+
+class QueryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Keep a snapshot of each pool, refreshed every `interval` seconds by `refresh_forever`,
+    and answer each connection from a separate thread.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, pools, interval=DEFAULT_INTERVAL, on_error=None):
+        self.pools = list(pools)
+        self.interval = interval
+        self.on_error = on_error
+        self.snapshots = {}
+        super().__init__(path, _RequestHandler)
+
+    def refresh(self):
+        for pool in self.pools:
+            try:
+                ads = backend.get_collector(pool).query('any', query.glideresource_constraint, [])
+                # Replacing the whole snapshot means requests never see a partial one.
+                self.snapshots[pool] = Snapshot(ads)
+            except Exception as exc:
+                if self.on_error is None:
+                    raise
+                self.on_error(pool, exc)
+
+    def refresh_forever(self):
+        # The first snapshot is taken by `serve` before connections are accepted.
+        while True:
+            time.sleep(self.interval)
+            self.refresh()
+
+    def answer(self, request):
+        """
+        Return the encoded response to a decoded request.
+        """
+        if not isinstance(request, dict) or request.get("version") != backend.SERVER_PROTOCOL_VERSION:
+            return _encode({"error": "unsupported request"})
+        snapshot = self.snapshots.get(request.get("pool"))
+        if snapshot is None:
+            return _encode({"error": "pool is not served"})
+
+        # By default, accept snapshots as old as the CLI accepts from its own cache, plus
+        # one refresh interval.
+        max_age = request.get("max_age")
+        if not isinstance(max_age, (int, float)):
+            max_age = cache.get_max_age() + self.interval
+        if time.time() - snapshot.created > max_age:
+            return _encode({"error": "snapshot is too old"})
+
+        try:
+            return snapshot.answer(request.get("constraint"), request.get("projection") or [])
+        except Exception as exc:
+            return _encode({"error": str(exc)})
+
+
+def _remove_stale_socket(path):
+    if not os.path.exists(path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            os.unlink(path)
+            return
+    raise RuntimeError("Another server is already listening on {}".format(path))
+
+
+def serve(path, pools, interval=DEFAULT_INTERVAL, on_error=None, on_ready=None):
+    """
+    Serve `pools` on the Unix socket `path` until interrupted.  The first snapshot of
+    each pool is taken before accepting connections, then `on_ready()` is called.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    _remove_stale_socket(path)
+    server = QueryServer(path, pools, interval, on_error)
+    try:
+        # Anyone able to reach the directory may query; the answers are public data.
+        os.chmod(path, 0o666)
+        server.refresh()
+        threading.Thread(target=server.refresh_forever, daemon=True).start()
+        if on_ready is not None:
+            on_ready()
+        server.serve_forever()
+    finally:
+        server.server_close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
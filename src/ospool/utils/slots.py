@@ -0,0 +1,173 @@
+"""Per-entry slot utilization, joining glidein startd ads to their factory entries"""
+
+import array
+import re
+import time
+
+import classad
+
+import ospool.utils.backend as backend
+import ospool.utils.query as query
+import ospool.utils.timing as timing
+
+
+# Attributes of the glidein startd ads needed for the join and the counters.
+startd_projection = [
+    'GLIDEIN_Entry_Name',   # Factory entry which submitted the glidein
+    'GLIDEIN_Factory',      # Factory which submitted the glidein, such as OSG
+    'State',                # Claimed, Unclaimed, ...
+    'Cpus',                 # Cores in the slot (left unused, for a partitionable slot)
+    'GPUs',                 # GPUs in the slot
+    'Memory',               # Memory in the slot, in MB
+    'EnteredCurrentState',  # Time the slot entered its current state
+]
+
+# Counters kept for each entry, along with the column label used when printing them.
+# Partitionable slots are never claimed themselves, so they count as unclaimed slots
+# holding the resources not yet given to a dynamic slot.
+slot_counters = [
+    ('slots',            'Slots'),
+    ('claimed_slots',    'Claimed'),
+    ('unclaimed_slots',  'Unclaimed'),
+    ('claimed_cpus',     'Cores used'),
+    ('unclaimed_cpus',   'Cores free'),
+    ('claimed_gpus',     'GPUs used'),
+    ('unclaimed_gpus',   'GPUs free'),
+    ('claimed_memory',   'MB used'),
+    ('unclaimed_memory', 'MB free'),
+    ('idle_age_total',   'Idle total'),
+    ('idle_age_max',     'Max idle'),
+]
+
+_idx = {name: idx for idx, (name, _) in enumerate(slot_counters)}
+SLOTS = _idx['slots']
+IDLE_AGE_TOTAL = _idx['idle_age_total']
+IDLE_AGE_MAX = _idx['idle_age_max']
+
+# Indices of the (slots, cores, GPUs, memory) counters for claimed and unclaimed slots.
+_claimed = tuple(_idx[name] for name in ('claimed_slots', 'claimed_cpus', 'claimed_gpus', 'claimed_memory'))
+_unclaimed = tuple(_idx[name] for name in ('unclaimed_slots', 'unclaimed_cpus', 'unclaimed_gpus', 'unclaimed_memory'))
+
+
+def _new_accumulator():
+    return array.array('q', bytes(8 * len(slot_counters)))
+
+
+def _int(value):
+    return value if type(value) is int else 0
+
+
+def _key(pool, name, factory):
+    return (pool, name.lower() if isinstance(name, str) else name, factory.lower() if isinstance(factory, str) else "")
+
+
+def entry_key(entry):
+    """
+    Return the key of a `model.Entry` in the dictionary returned by `join_slots`.
+    """
+    return _key(entry.pool, entry.name, entry.factory)
+
+
+def startd_constraint(filter_obj):
+    """
+    Return a constraint selecting the glidein startd ads which may belong to the
+    entries accepted by `filter_obj`, so the collector sends as few ads as possible.
+    """
+    clauses = ['MyType =?= "Machine"', 'GLIDEIN_Entry_Name =!= undefined']
+    if filter_obj.entry is not None:
+        clauses.append('regexp({}, GLIDEIN_Entry_Name, "i")'.format(
+            classad.quote("^" + query.glob_to_regex(filter_obj.entry) + "$")))
+    if filter_obj.factories:
+        clauses.append('regexp({}, GLIDEIN_Factory, "i")'.format(
+            classad.quote("^(" + "|".join(re.escape(name) for name in filter_obj.factories) + ")$")))
+    return " && ".join(clauses)
+
+
+def join_slots(entries, filter_obj, on_error=None, now=None):
+    """
+    Hash-join the startd ads of each pool to `entries` (`model.Entry` objects).
+
+    The entries form the hash table, keyed by `entry_key`; the startd ads are consumed
+    one at a time and released once counted, so memory only grows with the number of
+    entries.  Returns a tuple of a dictionary mapping each entry's key to its
+    accumulator (indexed like `slot_counters`) and the number of startd ads which
+    matched no entry.  Pools whose query fails are passed to `on_error(pool,
+    exception)` and skipped.
+    """
+    now = int(now if now is not None else time.time())
+    table = {}
+    for entry in entries:
+        table.setdefault(entry_key(entry), _new_accumulator())
+
+    constraint = startd_constraint(filter_obj)
+    unmatched = 0
+    for pool in dict.fromkeys(pool for pool, _, _ in table):
+        try:
+            with timing.stage("startd query") as details:
+                ads = backend.get_collector(pool).query('startd', constraint, startd_projection)
+                details.ads = len(ads)
+        except Exception as exc:
+            if on_error is None:
+                raise
+            on_error(pool, exc)
+            continue
+
+        with timing.stage("join") as details:
+            details.ads = len(ads)
+            # Popping from the end releases each ad as soon as it is counted.
+            while ads:
+                ad = ads.pop()
+                acc = table.get(_key(pool, ad.get('GLIDEIN_Entry_Name'), ad.get('GLIDEIN_Factory')))
+                if acc is None:
+                    unmatched += 1
+                    continue
+
+                acc[SLOTS] += 1
+                if ad.get('State') == "Claimed":
+                    slots_idx, cpus_idx, gpus_idx, memory_idx = _claimed
+                else:
+                    slots_idx, cpus_idx, gpus_idx, memory_idx = _unclaimed
+                    entered = ad.get('EnteredCurrentState')
+                    if type(entered) is int:
+                        age = max(now - entered, 0)
+                        acc[IDLE_AGE_TOTAL] += age
+                        if age > acc[IDLE_AGE_MAX]:
+                            acc[IDLE_AGE_MAX] = age
+                acc[slots_idx] += 1
+                acc[cpus_idx] += _int(ad.get('Cpus'))
+                acc[gpus_idx] += _int(ad.get('GPUs'))
+                acc[memory_idx] += _int(ad.get('Memory'))
+
+    return table, unmatched
+
+
+def total(accumulators):
+    """
+    Return a new accumulator combining `accumulators`; the maximum idle age is kept
+    rather than summed.
+    """
+    result = _new_accumulator()
+    for acc in accumulators:
+        for idx, value in enumerate(acc):
+            if idx == IDLE_AGE_MAX:
+                result[idx] = max(result[idx], value)
+            else:
+                result[idx] += value
+    return result
+
+
+def average_idle_age(acc):
+    """
+    Return the average time, in seconds, the entry's unclaimed slots have been idle, or
+    None if it has none.
+    """
+    unclaimed = acc[_unclaimed[0]]
+    return acc[IDLE_AGE_TOTAL] // unclaimed if unclaimed else None
+
+
+def format_age(seconds):
+    if seconds is None:
+        return "-"
+    if seconds < 3600:
+        return "{}m".format(seconds // 60)
+    return "{}h{:02d}m".format(seconds // 3600, seconds % 3600 // 60)
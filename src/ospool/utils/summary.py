@@ -0,0 +1,155 @@
+"""Pool-wide aggregation of entry counters and ranking of starved entries"""
+
+import array
+import heapq
+import operator
+
+import ospool.model as model
+
+
+# Counters summed by `ospool summary`, along with the column label used when printing them.
+summary_counters = [
+    ('GlideClientMonitorJobsIdle',              'Idle jobs'),
+    ('GlideClientMonitorJobsRunningHere',       'Run. jobs'),
+    ('GlideClientMonitorGlideinsRequestIdle',   'Req. idle'),
+    ('GlideClientMonitorGlideinsRequestMaxRun', 'Req. max'),
+    ('GlideFactoryMonitorRequestedIdle',        'Fact. idle'),
+    ('GlideFactoryMonitorRequestedMaxGlideins', 'Fact. max'),
+    ('GlideFactoryMonitorStatusPending',        'CE idle'),
+    ('GlideFactoryMonitorStatusRunning',        'CE running'),
+    ('GlideFactoryMonitorStatusHeld',           'Held'),
+    ('GlideClientMonitorGlideinsRunning',       'Slots'),
+    ('GlideClientMonitorGlideinsIdle',          'Idle slots'),
+]
+
+# Index of each counter in the accumulator arrays, followed by a slot counting the ads
+# and one holding the glidein requests removed by the factory.
+_idx = {attr: idx for idx, (attr, _) in enumerate(summary_counters)}
+AD_COUNT = len(summary_counters)
+FACTORY_CUT = AD_COUNT + 1
+
+summary_projection = ['GlideFactoryName', 'GlideGroupName', 'GLIDEIN_ResourceName', 'GLIDEIN_Gatekeeper'] + \
+    [attr for attr, _ in summary_counters]
+
+
+# Functions of an entry and one of its groups computing the aggregation key for each
+# `--by` choice.
+group_by_keys = {
+    'resource':    lambda entry, group: entry.resource,
+    'ce-hostname': lambda entry, group: entry.ce_host,
+    'group':       lambda entry, group: group.name,
+    'factory':     lambda entry, group: entry.factory,
+    'entry':       lambda entry, group: entry.name,
+}
+
+
+def _ratio(numerator, denominator):
+    return numerator / denominator if denominator > 0 else float(numerator)
+
+
+# Pressure metrics used to rank entries: (description, function of the entry's accumulator).
+rank_metrics = {
+    'idle-ratio': ("idle jobs per running glidein",
+        lambda acc: _ratio(acc[_idx['GlideClientMonitorJobsIdle']],
+            acc[_idx['GlideFactoryMonitorStatusRunning']] + 1)),
+    'idle-jobs': ("matching idle jobs",
+        lambda acc: acc[_idx['GlideClientMonitorJobsIdle']]),
+    'held-ratio': ("fraction of the factory's glideins which are held",
+        lambda acc: _ratio(acc[_idx['GlideFactoryMonitorStatusHeld']],
+            acc[_idx['GlideFactoryMonitorStatusHeld']] + acc[_idx['GlideFactoryMonitorStatusPending']] +
+            acc[_idx['GlideFactoryMonitorStatusRunning']])),
+    'factory-cut': ("glidein requests removed by factory limits",
+        lambda acc: acc[FACTORY_CUT]),
+}
+
+
+def _cut(requested, granted):
+    # Only a factory value actually reported can have reduced the request.
+    if requested is None or granted is None:
+        return 0
+    return max(requested - granted, 0)
+
+
+def factory_cut(group):
+    """
+    Return the glidein requests of a `model.GroupPressure` removed by the factory.
+    """
+    return _cut(group.request_idle, group.factory_request_idle) + _cut(group.request_max_run, group.factory_request_max)
+
+
+def _new_accumulator():
+    return array.array('q', bytes(8 * (FACTORY_CUT + 1)))
+
+
+def aggregate(entries, group_by):
+    """
+    Sum the counters of each group of the `model.Entry` objects in `entries` in a
+    single pass.
+
+    Returns a tuple of two dictionaries mapping to accumulator arrays (indexed like
+    `summary_counters`, plus `AD_COUNT` and `FACTORY_CUT`): one keyed by the `group_by`
+    key, the other by (pool, entry name, factory) for use in `rank_entries`.
+    """
+    key_func = group_by_keys[group_by]
+    get_counters = operator.attrgetter(*[model.group_fields[attr] for attr, _ in summary_counters])
+    groups = {}
+    per_entry = {}
+
+    for entry in entries:
+        entry_key = (entry.pool, entry.name, entry.factory)
+        entry_acc = per_entry.get(entry_key)
+        if entry_acc is None:
+            entry_acc = per_entry[entry_key] = _new_accumulator()
+
+        for group in entry.groups:
+            key = key_func(entry, group) or "Unknown"
+            group_acc = groups.get(key)
+            if group_acc is None:
+                group_acc = groups[key] = _new_accumulator()
+
+            for idx, value in enumerate(get_counters(group)):
+                if value is not None:
+                    group_acc[idx] += value
+                    entry_acc[idx] += value
+            group_acc[AD_COUNT] += 1
+            entry_acc[AD_COUNT] += 1
+            # Per group, so one group's cut is not hidden by another's larger request.
+            cut = factory_cut(group)
+            group_acc[FACTORY_CUT] += cut
+            entry_acc[FACTORY_CUT] += cut
+
+    return groups, per_entry
+
+
+def total(accumulators):
+    """
+    Return a new accumulator holding the sum of `accumulators`.
+    """
+    result = _new_accumulator()
+    for acc in accumulators:
+        for idx, value in enumerate(acc):
+            result[idx] += value
+    return result
+
+
+def rank_entries(per_entry, metric, count):
+    """
+    Return up to `count` (score, (pool, entry name, factory), accumulator) tuples for
+    the entries with the highest `metric`, keeping only `count` candidates in memory at
+    a time.
+    """
+    score_func = rank_metrics[metric][1]
+    heap = []
+    if count <= 0:
+        return heap
+    for order, (key, acc) in enumerate(per_entry.items()):
+        score = score_func(acc)
+        if score <= 0:
+            continue
+        # The insertion order breaks ties so accumulators are never compared.
+        item = (score, -order, key, acc)
+        if len(heap) < count:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+    return [(score, key, acc) for score, _, key, acc in sorted(heap, reverse=True)]
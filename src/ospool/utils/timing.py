@@ -0,0 +1,96 @@
+"""Per-stage timing of a command, reported by --timings and --metrics-file"""
+
+import collections
+import contextlib
+import threading
+import time
+
+
+class Stage(object):
+    """
+    Details of a stage filled in while it runs; `ads` and `nbytes` are optional.
+    """
+
+    __slots__ = ['ads', 'nbytes']
+
+    def __init__(self):
+        self.ads = None
+        self.nbytes = None
+
+
+class Timings(object):
+    """
+    Accumulates the time, ad count, and approximate bytes of each named stage.  Stages
+    run by several threads (e.g., one query per pool) are summed.
+    """
+
+    def __init__(self):
+        # Set when the results will be reported; enables the more expensive measurements.
+        self.enabled = False
+        # Set when the processed ads should be kept for the metrics textfile.
+        self.collect_entries = False
+        self.started = time.perf_counter()
+        self.stages = collections.OrderedDict()
+        # The ads most recently returned for each pool.
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, ads=None, nbytes=None):
+        with self._lock:
+            totals = self.stages.setdefault(name, [0.0, None, None])
+            totals[0] += seconds
+            if ads is not None:
+                totals[1] = (totals[1] or 0) + ads
+            if nbytes is not None:
+                totals[2] = (totals[2] or 0) + nbytes
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        details = Stage()
+        start = time.perf_counter()
+        try:
+            yield details
+        finally:
+            self.add(name, time.perf_counter() - start, details.ads, details.nbytes)
+
+    def add_entries(self, pool, entries):
+        # Only the latest ads of each pool are kept, so repeated queries of a pool do not
+        # grow the list.
+        if self.collect_entries:
+            with self._lock:
+                self.entries[pool] = entries
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+timings = Timings()
+
+stage = timings.stage
+
+
+def approximate_size(ads):
+    """
+    Approximate the bytes needed to transfer `ads` by the length of their ClassAd text.
+    """
+    return sum(len(str(ad)) for ad in ads)
+
+
+def _format_bytes(nbytes):
+    for unit in ("B", "KiB", "MiB"):
+        if nbytes < 1024:
+            return "{:.0f} {}".format(nbytes, unit) if unit == "B" else "{:.1f} {}".format(nbytes, unit)
+        nbytes /= 1024
+    return "{:.1f} GiB".format(nbytes)
+
+
+def format_report(timings):
+    """
+    Return the per-stage breakdown printed by --timings.
+    """
+    lines = ["{:<24}{:>10}{:>10}{:>12}".format("Stage", "Seconds", "Ads", "Size")]
+    for name, (seconds, ads, nbytes) in timings.stages.items():
+        lines.append("{:<24}{:>10.3f}{:>10}{:>12}".format(name, seconds,
+            "-" if ads is None else ads, "-" if nbytes is None else _format_bytes(nbytes)))
+    lines.append("{:<24}{:>10.3f}".format("total (wall clock)", timings.elapsed()))
+    return "\n".join(lines)
@@ -0,0 +1,64 @@
+"""Track changes in entry counters between successive collector snapshots"""
+
+import operator
+
+import ospool.model as model
+
+
+# Counters followed by `ospool watch`, along with the short label used when printing them.
+watch_counters = [
+    ('GlideClientMonitorJobsIdle',              'idle jobs'),
+    ('GlideClientMonitorJobsRunningHere',       'running jobs'),
+    ('GlideClientMonitorGlideinsRequestIdle',   'requested idle'),
+    ('GlideClientMonitorGlideinsRequestMaxRun', 'request limit'),
+    ('GlideFactoryMonitorStatusIdle',           'factory idle'),
+    ('GlideFactoryMonitorStatusPending',        'CE idle'),
+    ('GlideFactoryMonitorStatusRunning',        'CE running'),
+    ('GlideFactoryMonitorStatusHeld',           'held'),
+    ('GlideClientMonitorGlideinsRunning',       'slots'),
+    ('GlideClientMonitorGlideinsIdle',          'idle slots'),
+]
+
+watch_projection = ['GlideFactoryName', 'GlideGroupName'] + [attr for attr, _ in watch_counters]
+
+
+def take_snapshot(entries):
+    """
+    Reduce an iterable of `model.Entry` objects to a dictionary mapping each (entry
+    name, group name) pair to the tuple of its counter values.
+    """
+    get_counters = operator.attrgetter(*[model.group_fields[attr] for attr, _ in watch_counters])
+    snapshot = {}
+    for entry in entries:
+        for group in entry.groups:
+            snapshot[(entry.name, group.name)] = get_counters(group)
+    return snapshot
+
+
+def diff_snapshots(old, new):
+    """
+    Compare two snapshots, yielding (key, old counters, new counters) for each key whose
+    counters changed.  The old counters are None for new entries and the new counters
+    are None for entries which disappeared.
+    """
+    for key, counters in new.items():
+        old_counters = old.get(key)
+        if old_counters != counters:
+            yield key, old_counters, counters
+    for key, old_counters in old.items():
+        if key not in new:
+            yield key, old_counters, None
+
+
+def counter_deltas(old_counters, new_counters):
+    """
+    Yield (label, value, delta) for each counter; delta is None when the counter is
+    unchanged or cannot be compared.
+    """
+    for idx, (_, label) in enumerate(watch_counters):
+        value = new_counters[idx]
+        old_value = old_counters[idx] if old_counters else None
+        if isinstance(value, int) and isinstance(old_value, int) and value != old_value:
+            yield label, value, value - old_value
+        else:
+            yield label, value, None
@@ -0,0 +1,58 @@
+"""Check the pool usage history kept in the state directory"""
+
+import json
+import multiprocessing
+import sqlite3
+
+import pytest
+
+import ospool.utils.config as config
+
+
+@pytest.fixture
+def state_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_STATE_HOME", str(tmp_path))
+    for name, value in [("_state_db", None), ("_pool_usage", None), ("_pending_pools", [])]:
+        monkeypatch.setattr(config, name, value)
+    yield tmp_path / "ospool"
+    if config._state_db is not None:
+        config._state_db.close()
+
+
+def _use_pool(count):
+    # Each call runs in a fresh process, as separate ospool commands would.
+    config._state_db = None
+    for _ in range(count):
+        config.add_pool_history("cm.example.org")
+        config.flush_pool_history()
+
+
+def test_concurrent_uses_are_counted(state_dir, monkeypatch):
+    monkeypatch.setenv("OSPOOL_STATE_BACKEND", "sqlite")
+    config.get_state_db()
+    processes = [multiprocessing.get_context("fork").Process(target=_use_pool, args=(20, )) for _ in range(6)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    config._pool_usage = None
+    assert config._get_pool_usage()["cm.example.org"][0] == 120
+
+
+def test_flat_file_starts_from_state_db(state_dir, monkeypatch):
+    state_dir.mkdir(parents=True)
+    conn = sqlite3.connect(str(state_dir / "state.db"))
+    with conn:
+        conn.execute("CREATE TABLE pool_history (name text, uses INTEGER NOT NULL DEFAULT 0, last_used REAL)")
+        conn.execute("INSERT INTO pool_history VALUES ('old.example.org', 5, 100.0), ('older.example.org', 2, 50.0)")
+    conn.close()
+
+    monkeypatch.setenv("OSPOOL_STATE_BACKEND", "file")
+    assert config.get_pools_by_usage() == ["old.example.org", "older.example.org"]
+
+    config.add_pool_history("older.example.org")
+    config.flush_pool_history()
+    with open(str(state_dir / "pools.json")) as fp:
+        usage = json.load(fp)
+    assert usage["old.example.org"] == [5, 100.0]
+    assert usage["older.example.org"][0] == 3
@@ -0,0 +1,97 @@
+"""Check the collector constraint never rejects an ad the client-side filter accepts"""
+
+import fnmatch
+
+import classad
+import pytest
+
+import ospool.utils.query as query
+from synthetic import generate_ads
+
+
+def _ads():
+    ads = generate_ads(800)
+    # Names using the characters which need escaping or special handling in a regex.
+    for name, gatekeeper, resource, slots in [
+            ("Odd.Name+1_[x]", "CE-1.Example.ORG CE-1.Example.ORG:9619", "Res (1)", "GPUs,1,type=main;Cpus,8"),
+            ("Caret^Dollar$_gpu", "ce2.example.org", "RES|2", "Cpus,8;GPUs,type=main"),
+            ("back\\slash", "ce3.example.org ce3.example.org:9619", "RES-3", "NotGPUs,1"),
+            ("[!]bang", "ce4.example.org", "[RES]", "GPUsFoo,1"),
+            ("Ends^", "ce5.example.org", "RES-5", "")]:
+        for factory in ("OSG", "OSG-ITB"):
+            ads.append({
+                'MyType': 'glideresource',
+                'GlideFactoryName': "{}@gfactory_instance@{}".format(name, factory),
+                'GLIDEIN_Gatekeeper': gatekeeper,
+                'GLIDEIN_ResourceName': resource,
+                'GLIDEIN_Resource_Slots': slots,
+            })
+    # Attributes missing entirely.
+    ads.append({'MyType': 'glideresource', 'GlideFactoryName': "Bare@gfactory_instance@OSG"})
+    return ads
+
+
+def _reference(ad, resource=None, gpus_only=False, ce_hostname=None, entry=None, factory=None):
+    # The filter as originally written, with fnmatch and string splitting.
+    factory_name = ad['GlideFactoryName']
+    if gpus_only and not any(slot.split(",")[0] == 'GPUs' for slot in ad.get('GLIDEIN_Resource_Slots', "").split(";")):
+        return False
+    if factory and factory_name.rsplit("@", 1)[-1].lower() not in [name.lower() for name in factory]:
+        return False
+    if entry and not fnmatch.fnmatch(factory_name.split("@", 1)[0].lower(), entry.lower()):
+        return False
+    if resource and ('GLIDEIN_ResourceName' not in ad or
+            not fnmatch.fnmatch(ad['GLIDEIN_ResourceName'].lower(), resource.lower())):
+        return False
+    if ce_hostname and ('GLIDEIN_Gatekeeper' not in ad or
+            not fnmatch.fnmatch(ad['GLIDEIN_Gatekeeper'].split(" ", 1)[0].lower(), ce_hostname.lower())):
+        return False
+    return True
+
+
+filters = [
+    {},
+    {'entry': "*"},
+    {'entry': "OSG_US_CHTC_*"},
+    {'entry': "osg_us_?htc_1*"},
+    {'entry': "*[!0-4]_gpu"},
+    {'entry': "*[0-9]"},
+    {'entry': "[[]*"},
+    {'entry': "odd.name+1_[[]x]"},
+    {'entry': "caret^dollar$*"},
+    {'entry': "back\\slash"},
+    {'entry': "[!]bang"},
+    {'entry': "[!o]*"},
+    {'entry': "*[^x]"},
+    {'entry': "OSG_US_UCSD_1"},
+    {'entry': "[unterminated"},
+    {'factory': ["OSG"]},
+    {'factory': ["osg-itb"]},
+    {'factory': ["OSG", "OSG-ITB"]},
+    {'gpus_only': True},
+    {'resource': "CHTC-*"},
+    {'resource': "res (?)"},
+    {'resource': "res|?"},
+    {'resource': "[[]res]"},
+    {'ce_hostname': "*.chtc.edu"},
+    {'ce_hostname': "ce1?.*"},
+    {'ce_hostname': "CE-1.example.org"},
+    {'ce_hostname': "*"},
+    {'entry': "*_gpu", 'factory': ["OSG"], 'gpus_only': True, 'ce_hostname': "ce?.*", 'resource': "*-CE?"},
+]
+
+
+@pytest.mark.parametrize("kwargs", filters, ids=[repr(kwargs) for kwargs in filters])
+def test_constraint_accepts_filtered_ads(kwargs):
+    filter_obj = query.EntryFilter(**kwargs)
+    constraint = classad.ExprTree(filter_obj.get_constraint())
+    accepted = 0
+    for ad in _ads():
+        expected = _reference(ad, **kwargs)
+        assert filter_obj(ad) == expected, ad['GlideFactoryName']
+        if expected:
+            accepted += 1
+            assert constraint.eval(classad.ClassAd(ad)) is True, ad['GlideFactoryName']
+    assert filter_obj.filter_many(_ads()) == [ad for ad in _ads() if _reference(ad, **kwargs)]
+    if kwargs.get('entry') != "[unterminated":
+        assert accepted, "no ad exercises the filter"
@@ -0,0 +1,59 @@
+"""Check that entry history keeps a separate series for each factory"""
+
+import sqlite3
+
+import pytest
+
+import ospool.model as model
+import ospool.utils.config as config
+import ospool.utils.history as history
+import ospool.utils.query as query
+
+
+@pytest.fixture
+def state_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_STATE_HOME", str(tmp_path))
+    monkeypatch.setenv("OSPOOL_STATE_BACKEND", "sqlite")
+    monkeypatch.setattr(config, "_state_db", None)
+    yield tmp_path / "ospool"
+    if config._state_db is not None:
+        config._state_db.close()
+
+
+def _ad(factory, jobs_idle, pool="cm.example.org", group="main"):
+    return {
+        query.source_pool_attr: pool,
+        'GlideFactoryName': "E@gfactory_instance@{}".format(factory),
+        'GlideGroupName': group,
+        'GlideClientMonitorJobsIdle': jobs_idle,
+    }
+
+
+def test_series_per_factory(state_dir):
+    ads = [_ad("OSG", 1), _ad("OSG-ITB", 7)]
+    assert history.record_snapshot(model.entries_from_ads(ads)) == 2
+
+    samples = history.get_entry_history("E", 3600)
+    assert [(sample['Factory'], sample['jobs_idle']) for sample in samples] == [("OSG", 1), ("OSG-ITB", 7)]
+
+    samples = history.get_entry_history("e", 3600, factory="osg-itb")
+    assert [(sample['Factory'], sample['jobs_idle']) for sample in samples] == [("OSG-ITB", 7)]
+
+
+def test_series_recorded_without_factory(state_dir):
+    state_dir.mkdir(parents=True)
+    conn = sqlite3.connect(str(state_dir / "state.db"))
+    with conn:
+        conn.execute("""CREATE TABLE entry_series (
+            id INTEGER PRIMARY KEY, pool TEXT NOT NULL, entry TEXT NOT NULL, grp TEXT NOT NULL,
+            UNIQUE (pool, entry, grp))""")
+        conn.execute("CREATE TABLE entry_samples (series INTEGER NOT NULL, ts INTEGER NOT NULL, "
+            "samples INTEGER NOT NULL DEFAULT 1, {}, PRIMARY KEY (series, ts)) WITHOUT ROWID".format(
+                ", ".join("{} INTEGER".format(column) for column in history.history_columns)))
+        conn.execute("INSERT INTO entry_series (id, pool, entry, grp) VALUES (5, 'cm.example.org', 'E', 'main')")
+        conn.execute("INSERT INTO entry_samples (series, ts, jobs_idle) VALUES (5, strftime('%s', 'now') - 60, 3)")
+    conn.close()
+
+    history.record_snapshot(model.entries_from_ads([_ad("OSG", 1)]))
+    samples = history.get_entry_history("E", 3600)
+    assert [(sample['Factory'], sample['jobs_idle']) for sample in samples] == [(None, 3), ("OSG", 1)]
@@ -0,0 +1,17 @@
+"""Check the entry counters written to the OpenMetrics textfile"""
+
+import ospool.utils.metrics as metrics
+import ospool.utils.timing as timing
+
+
+def test_sample_per_factory():
+    timings = timing.Timings()
+    timings.entries["cm.example.org"] = [
+        {'GlideFactoryName': "E@gfactory_instance@{}".format(factory), 'GlideGroupName': "main",
+            'GlideClientMonitorJobsIdle': jobs_idle}
+        for factory, jobs_idle in [("OSG", 1), ("OSG-ITB", 7)]]
+    lines = [line for line in metrics.format_metrics(timings).splitlines() if line.startswith("ospool_entry_jobs_idle{")]
+    assert lines == [
+        'ospool_entry_jobs_idle{pool="cm.example.org",entry="E",factory="OSG",group="main"} 1',
+        'ospool_entry_jobs_idle{pool="cm.example.org",entry="E",factory="OSG-ITB",group="main"} 7',
+    ]
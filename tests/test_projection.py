@@ -0,0 +1,135 @@
+"""Check that each renderer only needs the attributes its projection fetches"""
+
+import pytest
+
+import ospool.model as model
+import ospool.utils.output as output_utils
+import ospool.utils.projection as projection
+import ospool.utils.query as query
+import ospool.utils.render as render
+
+
+# Added to every ad by `query_pools`, so never part of a projection.
+added_attrs = {query.source_pool_attr}
+
+
+class RecordingAd(dict):
+    """
+    A glideresource ad which records the name of every attribute looked up.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read = set()
+
+    def __getitem__(self, key):
+        self.read.add(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.read.add(key)
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        self.read.add(key)
+        return super().__contains__(key)
+
+
+def _ads():
+    # Between them, the ads take every branch of the renderers: whole-node and fixed
+    # core counts, GPUs, downtime, every limit, held glideins, and changed requests.
+    ads = []
+    for idx, (name, factory, cpus, slots, downtime) in enumerate([
+            ("Whole_Node_Entry", "OSG", "auto", "GPUs,2,type=main", True),
+            ("Fixed_Entry", "OSG-ITB", "8", "GPUs,type=main", "False"),
+            ("Single_Core_Entry", "OSG", "1", "", "True")]):
+        for group_idx, group in enumerate(["main", "gpu"]):
+            ad = {
+                query.source_pool_attr: "cm{}.example.org".format(idx % 2),
+                'MyType': "glideresource",
+                'GlideFactoryName': "{}@gfactory_instance@{}".format(name, factory),
+                'GlideGroupName': group,
+                'GLIDEIN_ResourceName': "RESOURCE_{}".format(idx),
+                'GLIDEIN_Gatekeeper': "ce{0}.example.org ce{0}.example.org:9619".format(idx),
+                'GLIDEIN_CPUS': cpus,
+                'GLIDEIN_ESTIMATED_CPUS': 32,
+                'GLIDEIN_Resource_Slots': slots,
+                'GLIDEIN_In_Downtime': downtime,
+                'GLIDEIN_MaxMemMBs': 4096,
+                'GLIDEIN_Site': "SITE_{}".format(idx),
+            }
+            for counter_idx, (attr, _) in enumerate(model.counters):
+                ad[attr] = 10 * idx + counter_idx + group_idx
+            if idx == 0:
+                for attr in model.entry_limit_attrs + model.group_limit_attrs:
+                    ad[attr] = "limit reached"
+            ads.append(ad)
+    return ads
+
+
+def _recorded(ads):
+    ads = [RecordingAd(ad) for ad in ads]
+    return ads, lambda: set().union(*(ad.read for ad in ads)) - added_attrs
+
+
+def _projected(ads, attrs):
+    attrs = set(attrs) | added_attrs
+    return [{attr: value for attr, value in ad.items() if attr in attrs} for ad in ads]
+
+
+def _render_entries(ads):
+    return "".join(render.format_entry(entry, show_pool=True, show_factory=True)
+        for entry in model.entries_from_ads(ads))
+
+
+def _render_table(ads, fields):
+    return render.format_table(model.entries_from_ads(ads, model.extra_fields(fields)), fields)
+
+
+def _render_records(ads, fields):
+    return [output_utils.entry_record(ad, fields) for ad in ads]
+
+
+table_field_lists = [
+    render.table_fields,
+    ['EntryName', 'Pool'] + render.table_fields[1:],
+    ['Pool', 'Factory', 'CEHostname', 'GLIDEIN_ResourceName', 'GlideGroupName', 'GLIDEIN_MaxMemMBs', 'GLIDEIN_Site'],
+]
+
+record_field_lists = [
+    output_utils.show_fields,
+    output_utils.list_fields,
+    ['CEHostname', 'GLIDEIN_MaxMemMBs', 'EntryName', 'GLIDEIN_Site'],
+]
+
+
+def test_format_entry_attrs():
+    ads, read = _recorded(_ads())
+    _render_entries(ads)
+    assert read() <= set(render.entry_attrs)
+
+
+def test_format_entry_projection():
+    ads = _ads()
+    assert _render_entries(_projected(ads, render.entry_attrs)) == _render_entries(ads)
+
+
+@pytest.mark.parametrize("fields", table_field_lists)
+def test_format_table_projection(fields):
+    # Parsing an Entry looks up every attribute of `model.projection`, so the table is
+    # checked by rendering it from only the planned attributes instead.
+    ads = _ads()
+    assert _render_table(_projected(ads, render.table_attrs(fields)), fields) == _render_table(ads, fields)
+
+
+@pytest.mark.parametrize("fields", record_field_lists)
+def test_entry_record_attrs(fields):
+    ads, read = _recorded(_ads())
+    _render_records(ads, fields)
+    assert read() <= set(projection.plan(fields))
+
+
+@pytest.mark.parametrize("fields", record_field_lists)
+def test_entry_record_projection(fields):
+    ads = _ads()
+    assert _render_records(_projected(ads, projection.plan(fields)), fields) == _render_records(ads, fields)
@@ -0,0 +1,39 @@
+"""Check the answers of `ospool serve` match a collector query"""
+
+import json
+
+import classad
+
+import ospool.utils.server as server
+
+
+def _snapshot():
+    return server.Snapshot([classad.ClassAd({'MyType': "glideresource", 'GlideFactoryName': "E{}@gfactory_instance@OSG".format(idx),
+        'GLIDEIN_CPUS': "8", 'GLIDEIN_MaxMemMBs': 2048 * idx}) for idx in range(3)])
+
+
+def _ads(response):
+    return json.loads(response)["ads"]
+
+
+def test_projection_ignores_case():
+    ads = _ads(_snapshot().answer('MyType =?= "glideresource"', ['glidein_cpus', 'GlideFactoryName', 'Missing']))
+    assert ads == [{'glidein_cpus': "8", 'GlideFactoryName': "E{}@gfactory_instance@OSG".format(idx)} for idx in range(3)]
+
+
+def test_constraint():
+    ads = _ads(_snapshot().answer('GLIDEIN_MaxMemMBs > 2048', ['GlideFactoryName']))
+    assert ads == [{'GlideFactoryName': "E2@gfactory_instance@OSG"}]
+
+
+def test_cached_responses_are_bounded(monkeypatch):
+    snapshot = _snapshot()
+    size = len(snapshot.answer(None, ['GlideFactoryName']))
+    monkeypatch.setattr(server, "MAX_CACHED_RESPONSE_BYTES", 2 * size)
+    for attr in ['GLIDEIN_CPUS', 'GLIDEIN_MaxMemMBs', 'MyType']:
+        snapshot.answer(None, [attr])
+    assert snapshot.response_bytes == sum(len(response) for response in snapshot.responses.values())
+    assert snapshot.response_bytes <= 2 * size
+    # The least recently used responses are dropped first.
+    assert (None, ('GlideFactoryName', )) not in snapshot.responses
+    assert list(snapshot.responses)[-1] == (None, ('MyType', ))
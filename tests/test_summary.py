@@ -0,0 +1,37 @@
+"""Check the ranking of entries by the glidein requests the factory removed"""
+
+import ospool.model as model
+import ospool.utils.query as query
+import ospool.utils.summary as summary
+
+
+def _ad(entry, group, request_idle, request_max, factory_idle=None, factory_max=None):
+    ad = {
+        query.source_pool_attr: "cm.example.org",
+        'GlideFactoryName': "{}@gfactory_instance@OSG".format(entry),
+        'GlideGroupName': group,
+        'GlideClientMonitorGlideinsRequestIdle': request_idle,
+        'GlideClientMonitorGlideinsRequestMaxRun': request_max,
+    }
+    if factory_idle is not None:
+        ad['GlideFactoryMonitorRequestedIdle'] = factory_idle
+    if factory_max is not None:
+        ad['GlideFactoryMonitorRequestedMaxGlideins'] = factory_max
+    return ad
+
+
+def test_factory_cut():
+    ads = [
+        # No factory attributes: nothing is known to have been removed.
+        _ad("Unreported", "main", 50, 500),
+        # The factory granted every request.
+        _ad("Unchanged", "main", 50, 500, 50, 500),
+        # One group's cut is not hidden by another group's request above the factory's.
+        _ad("Mixed", "main", 20, 100, 5, 100),
+        _ad("Mixed", "gpu", 0, 10, 30, 10),
+        # Only the reported factory value counts.
+        _ad("Partial", "main", 40, 400, 30),
+    ]
+    _, per_entry = summary.aggregate(model.entries_from_ads(ads), 'entry')
+    ranked = summary.rank_entries(per_entry, 'factory-cut', 10)
+    assert [(key[1], score) for score, key, _ in ranked] == [("Mixed", 15), ("Partial", 10)]